@@ -0,0 +1,133 @@
+"""Precomputed continent/year rollups.
+
+The notebook recomputes `df.groupby(by='Continent').sum()` and the world
+totals per year for every chart. `AggregateCube` computes those sums once for
+every value of the configured dimensions (and for the whole world), answers
+queries with a dict lookup and keeps the sums current when rows are added,
+revised or deleted.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from population_data import POPULATION_COLUMNS, population_columns
+
+AREA_COLUMN = 'Area (km²)'
+WORLD = ((), ())
+
+
+def _population_column(year):
+    return year if str(year).endswith(' Population') else f'{year} Population'
+
+
+class AggregateCube:
+    """Totals, counts, density and growth per dimension value and year.
+
+    `dimensions` lists the categorical columns to roll up over. Every subset
+    of them gets its own cells, so with ``('Continent', 'Sub-region')`` both
+    ``total(2022, Continent='Asia')`` and ``total(2022, Continent='Asia',
+    **{'Sub-region': 'Eastern Asia'})`` are single lookups. Rows are keyed by
+    CCA3 so `upsert` and `delete` can take back their old contribution.
+
+    The population years are the `<year> Population` columns of `df` (the
+    dataset's census years for an empty cube); rows upserted later must
+    not bring new years.
+    """
+
+    def __init__(self, df=None, dimensions=('Continent',)):
+        self.dimensions = tuple(dimensions)
+        self.population_columns = POPULATION_COLUMNS if df is None else population_columns(df)
+        self.measures = self.population_columns + [AREA_COLUMN]
+        self._position = {measure: i for i, measure in enumerate(self.measures)}
+        self._sums = {}
+        self._counts = {}
+        self._rows = {}
+        if df is not None:
+            self.upsert(df)
+
+    def _keys(self, labels):
+        # the world cell plus one cell per non-empty subset of dimensions
+        yield WORLD
+        for size in range(1, len(self.dimensions) + 1):
+            for names in itertools.combinations(self.dimensions, size):
+                yield names, tuple(labels[name] for name in names)
+
+    def _apply(self, labels, measures, sign):
+        for key in self._keys(labels):
+            if key in self._sums:
+                self._sums[key] += sign * measures
+                self._counts[key] += sign
+            else:
+                self._sums[key] = sign * measures
+                self._counts[key] = sign
+            if self._counts[key] == 0:
+                del self._sums[key], self._counts[key]
+
+    def upsert(self, df):
+        """Add the rows of `df`, replacing rows with a CCA3 code already in the cube."""
+        new = set(population_columns(df)) - set(self.population_columns)
+        if new:
+            # the existing cells have no sums for these years, build a new cube instead
+            raise ValueError(f"population columns not in the cube: {', '.join(sorted(new))}")
+        measures = df[self.measures].to_numpy(dtype=np.float64)
+        labels = df[list(self.dimensions)].to_dict('records')
+        for code, row_labels, row_measures in zip(df['CCA3'], labels, measures):
+            if code in self._rows:
+                self._apply(*self._rows[code], -1)
+            self._rows[code] = (row_labels, row_measures)
+            self._apply(row_labels, row_measures, 1)
+
+    def delete(self, codes):
+        for code in codes:
+            self._apply(*self._rows.pop(code), -1)
+
+    def _key(self, filters):
+        names = tuple(name for name in self.dimensions if name in filters)
+        if len(names) != len(filters):
+            unknown = set(filters) - set(self.dimensions)
+            raise KeyError(f"not a cube dimension: {', '.join(sorted(unknown))}")
+        return names, tuple(filters[name] for name in names)
+
+    def _cell(self, filters):
+        key = self._key(filters)
+        if key not in self._sums:
+            raise KeyError(f"no rows for {dict(zip(*key)) or 'world'}")
+        return self._sums[key]
+
+    def total(self, year, **filters):
+        """Population in `year`, e.g. ``total(2022, Continent='Asia')``; no filters means world."""
+        return self._cell(filters)[self._position[_population_column(year)]]
+
+    def count(self, **filters):
+        return self._counts.get(self._key(filters), 0)
+
+    def area(self, **filters):
+        return self._cell(filters)[self._position[AREA_COLUMN]]
+
+    def density(self, year, **filters):
+        """Population per km² over the whole group (not the mean of country densities)."""
+        cell = self._cell(filters)
+        return cell[self._position[_population_column(year)]] / cell[self._position[AREA_COLUMN]]
+
+    def growth(self, start_year, end_year, **filters):
+        """Average yearly growth factor between two census years."""
+        cell = self._cell(filters)
+        start = cell[self._position[_population_column(start_year)]]
+        end = cell[self._position[_population_column(end_year)]]
+        return (end / start) ** (1 / (int(end_year) - int(start_year)))
+
+    def world_totals(self, years=None):
+        """World population per year, like ``df[population_years].sum()``."""
+        columns = [_population_column(year) for year in years] if years else self.population_columns[::-1]
+        cell = self._sums[WORLD]
+        return pd.Series([cell[self._position[column]] for column in columns], index=columns)
+
+    def frame(self, dimension):
+        """Sums per value of one dimension, shaped like the notebook's `continent_df`."""
+        rows = {labels[0]: sums for (names, labels), sums in self._sums.items() if names == (dimension,)}
+        frame = pd.DataFrame.from_dict(rows, orient='index', columns=self.measures).sort_index()
+        frame.index.name = dimension
+        frame['Count'] = [self._counts[((dimension,), (label,))] for label in frame.index]
+        return frame
@@ -0,0 +1,99 @@
+"""Yearly population grid interpolated from the census years.
+
+The dataset only has the years 1970, 1980, 1990, 2000, 2010, 2015, 2020 and
+2022. `annualize_panel` fills in every year in between for all countries in
+one vectorized call:
+
+- "log_pchip": monotone cubic (PCHIP) interpolation of the log population,
+  i.e. smoothly varying growth rates between census years (default)
+- "pchip": PCHIP on the population itself
+- "linear": straight lines between census years
+
+PCHIP never overshoots, so a country whose population rises (or falls)
+between two census years does so in every year in between. Observed values
+are kept exactly; `observed` flags which grid years are census years.
+
+The annual frame has the same layout as `time_series_data`. Pass it
+together with its `observed` flags to `forecasting.forecast_all`,
+`forecasting.batch_forecast`, `reconciliation.hierarchical_forecast` or
+`backtesting.backtest`, so that forecasts are only scored on census years;
+without the flags they would be scored on interpolated points.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from population_data import CACHE_DIR, DATA_PATH, PopulationPanel, _load_panel, _normalize
+
+METHODS = ('log_pchip', 'pchip', 'linear')
+
+
+def interpolate(values, years, grid, method='log_pchip'):
+    """Interpolate every row of `values` (series x ascending `years`) onto `grid`."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    values = np.asarray(values, dtype=float)
+    years = np.asarray(years, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    if method == 'linear':
+        # the census years are shared by all rows, so one set of weights serves all
+        left = np.clip(np.searchsorted(years, grid, side='right') - 1, 0, len(years) - 2)
+        t = (grid - years[left]) / (years[left + 1] - years[left])
+        return values[:, left] * (1 - t) + values[:, left + 1] * t
+    from scipy.interpolate import PchipInterpolator
+
+    if method == 'log_pchip':
+        return np.exp(PchipInterpolator(years, np.log(np.maximum(values, 1)), axis=1)(grid))
+    return PchipInterpolator(years, values, axis=1)(grid)
+
+
+def annualize_panel(panel, method='log_pchip', step=1):
+    """A `PopulationPanel` with one column per `step` years and an `observed` flag per year."""
+    grid = np.arange(panel.years[0], panel.years[-1] + 1, step)
+    observed = np.isin(grid, panel.years)
+    values = np.ascontiguousarray(interpolate(panel.values, panel.years, grid, method))
+    # keep the census values bit for bit, the log round trip is not exact
+    known = np.isin(panel.years, grid)
+    values[:, observed] = panel.values[:, known]
+    return PopulationPanel(values, grid, panel.codes, panel.categories, panel.attributes, observed=observed)
+
+
+def annualize(time_series_data, method='log_pchip', step=1):
+    """Yearly version of `time_series_data` (newest year first) and its `observed` flags.
+
+    `observed` is a boolean Series on the same DatetimeIndex.
+    """
+    index = time_series_data.index[::-1]
+    years = np.asarray(index.year)
+    grid = np.arange(years[0], years[-1] + 1, step)
+    values = interpolate(time_series_data.to_numpy(dtype=float)[::-1].T, years, grid, method)
+    observed = np.isin(grid, years)
+    values[:, observed] = time_series_data.to_numpy(dtype=float)[::-1].T[:, np.isin(years, grid)]
+    grid_index = pd.to_datetime([str(year) for year in grid[::-1]])
+    annual = pd.DataFrame(values.T[::-1], index=grid_index, columns=time_series_data.columns)
+    return annual, pd.Series(observed[::-1], index=grid_index, name='observed')
+
+
+def observed_frame(panel):
+    """Boolean (countries x years) DataFrame, True where a value is a census value."""
+    flags = np.broadcast_to(panel.observed, panel.values.shape)
+    return pd.DataFrame(flags, index=pd.Index(panel.codes, name='CCA3'), columns=panel.years)
+
+
+def load_annual_panel(path=DATA_PATH, cache_dir=CACHE_DIR, method='log_pchip'):
+    """Annualized panel of the dataset, computed once per process and method."""
+    return _load_annual_panel(*_normalize(path, cache_dir), method)
+
+
+@lru_cache(maxsize=None)
+def _load_annual_panel(path, cache_dir, method):
+    return annualize_panel(_load_panel(path, cache_dir), method)
+
+
+def load_annual_time_series(path=DATA_PATH, cache_dir=CACHE_DIR, method='log_pchip'):
+    """Annual `time_series_data` and its `observed` flags, sharing memory with the panel."""
+    panel = load_annual_panel(path, cache_dir, method)
+    time_series_data = panel.to_time_series()
+    return time_series_data, pd.Series(panel.observed[::-1], index=time_series_data.index, name='observed')
@@ -0,0 +1,154 @@
+"""Walk-forward backtesting of the population forecasts.
+
+The notebook scores every country on one fixed split. `backtest` moves the
+forecast origin over every possible cutoff year instead and stores all
+forecasts in a (country x cutoff x horizon) cube, so MAE, RMSE, MAPE and bias
+are plain NumPy reductions over that cube.
+
+The batch models are fitted for all countries at once per cutoff. ARIMA is
+fitted once per country and then carried forward from origin to origin by
+appending the next observation to the fitted state, with an optional full
+refit (warm-started from the previous parameters) every `refit_every` origins.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from forecasting import BATCH_MODELS, _ascending, _run_chunks, batch_predict
+
+MODELS = BATCH_MODELS + ('arima',)
+
+
+def _arima_walk(values, cutoffs, horizon, order, refit_every):
+    from statsmodels.tsa.arima.model import ARIMA
+
+    forecast = np.full((len(cutoffs), horizon), np.nan)
+    fit = None
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for i, cutoff in enumerate(cutoffs):
+            try:
+                if fit is None or (refit_every and i % refit_every == 0):
+                    start_params = fit.params if fit is not None else None
+                    fit = ARIMA(values[:cutoff], order=order).fit(start_params=start_params)
+                else:
+                    # keep the estimated parameters and only run the filter
+                    # over the one new observation
+                    fit = fit.append(values[cutoff - 1:cutoff])
+                steps = int(min(horizon, len(values) - cutoff))
+                forecast[i, :steps] = fit.forecast(steps)
+            except Exception:
+                fit = None
+    return forecast
+
+
+def _arima_chunk(series, cutoffs, horizon, order, refit_every):
+    return [_arima_walk(values, cutoffs, horizon, order, refit_every) for values in series]
+
+
+def _arima_cube(values, cutoffs, horizon, order, refit_every, workers):
+    series = [np.ascontiguousarray(values[:, j]) for j in range(values.shape[1])]
+    return np.stack(_run_chunks(_arima_chunk, series, workers, None, cutoffs, horizon, order, refit_every))
+
+
+def backtest(time_series_data, models=('drift', 'ar', 'loglinear'), horizon=2, min_train=None, p=1,
+             arima_order=(1, 1, 0), refit_every=None, workers=None, observed=None):
+    """Rolling-origin forecasts of every column of `time_series_data` for every model.
+
+    The origin runs from `min_train` observations up to the second to last
+    one; forecasts past the end of the data are NaN. `min_train` defaults to
+    4, or to the 2p+2 points an AR(p) needs if that is more. Returns a dict with the
+    `countries`, the `cutoffs` (first forecast year of each origin), the
+    `actual` cube and one forecast cube per model in `forecasts`, all of
+    shape (countries, cutoffs, horizon).
+
+    For an annualized frame pass its `observed` flags (same index as
+    `time_series_data`); interpolated target years are then left out of
+    `actual` and only census years are scored.
+    """
+    unknown = set(models) - set(MODELS)
+    if unknown:
+        raise ValueError(f"Unknown models {sorted(unknown)}, expected some of {MODELS}")
+    ar_min_train = 2 * p + 2 if 'ar' in models else 0
+    if min_train is None:
+        min_train = max(4, ar_min_train)
+    elif min_train < ar_min_train:
+        raise ValueError(f"AR({p}) needs min_train of at least {ar_min_train}, got {min_train}")
+    index, values = _ascending(time_series_data)
+    n_years = values.shape[0]
+    cutoffs = np.arange(min_train, n_years)
+    if len(cutoffs) == 0:
+        raise ValueError(f"need more than {min_train} observations, got {n_years}")
+
+    target = cutoffs[:, None] + np.arange(horizon)
+    valid = target < n_years
+    if observed is not None:
+        valid &= np.asarray(observed, dtype=bool)[::-1][np.minimum(target, n_years - 1)]
+    actual = np.where(valid, values[np.minimum(target, n_years - 1)].transpose(2, 0, 1), np.nan)
+
+    forecasts = {}
+    for model in models:
+        if model == 'arima':
+            forecasts[model] = _arima_cube(values, cutoffs, horizon, arima_order, refit_every, workers)
+            continue
+        cube = np.empty_like(actual)
+        for i, cutoff in enumerate(cutoffs):
+            cube[:, i, :] = batch_predict(values[:cutoff], model, p, horizon).T
+        forecasts[model] = np.where(valid, cube, np.nan)
+
+    return {
+        'countries': time_series_data.columns,
+        'cutoffs': index[cutoffs],
+        'scale': values[-1],
+        'actual': actual,
+        'forecasts': forecasts,
+    }
+
+
+def error_metrics(forecast, actual, scale=None, axis=None):
+    """MAE, RMSE, MAPE (in %) and bias of a forecast cube, ignoring NaN cells.
+
+    With `scale` (one value per country, e.g. the 2022 population) MAE, RMSE
+    and bias are divided by it, like the notebook's normalized metrics.
+    `axis` is passed to the reductions.
+    """
+    errors = forecast - actual
+    if scale is not None:
+        scaled = errors / np.asarray(scale, dtype=float).reshape((-1,) + (1,) * (errors.ndim - 1))
+    else:
+        scaled = errors
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return {
+            'mae': np.nanmean(np.abs(scaled), axis=axis),
+            'rmse': np.sqrt(np.nanmean(scaled ** 2, axis=axis)),
+            'mape': 100 * np.nanmean(np.abs(errors / actual), axis=axis),
+            'bias': np.nanmean(scaled, axis=axis),
+        }
+
+
+def summarize(result, by='overall', normalize=True):
+    """Metrics of every model in a `backtest` result as a DataFrame.
+
+    `by` is 'overall', 'horizon', 'cutoff' or 'country'.
+    """
+    axes = {'overall': None, 'country': (1, 2), 'cutoff': (0, 2), 'horizon': (0, 1)}
+    if by not in axes:
+        raise ValueError(f"Unknown grouping {by!r}, expected one of {tuple(axes)}")
+    labels = {
+        'country': result['countries'],
+        'cutoff': result['cutoffs'],
+        'horizon': pd.RangeIndex(1, result['actual'].shape[2] + 1, name='horizon'),
+    }
+    scale = result['scale'] if normalize else None
+    frames = []
+    for model, forecast in result['forecasts'].items():
+        metrics = error_metrics(forecast, result['actual'], scale, axes[by])
+        if by == 'overall':
+            frames.append(pd.DataFrame(metrics, index=pd.Index([model], name='model')))
+        else:
+            frame = pd.DataFrame(metrics, index=labels[by])
+            frames.append(frame.assign(model=model).set_index('model', append=True).swaplevel())
+    return pd.concat(frames)
@@ -0,0 +1,191 @@
+"""Benchmarks for the load, EDA and forecasting stages of the notebook.
+
+Runs every stage on `world_population.csv` and on synthetic tables with the
+same columns, and reports the best and mean wall time, throughput in series
+per second and the peak traced memory of each stage. tracemalloc only sees
+this process, so stages that run on a process pool report the peak resident
+memory of their largest worker instead.
+
+    python benchmark.py --repeat 3 --sizes 10000,100000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from annualization import annualize_panel
+from forecasting import forecast_all, batch_forecast
+from instrumentation import peak_rss
+from population_data import (DATA_PATH, NON_POPULATION_COLUMNS, POPULATION_COLUMNS, YEARS, PopulationPanel,
+                             clear_memory_cache, load_population)
+
+STAGES = ['load', 'load_cached', 'reshape', 'panel', 'annualize', 'corr', 'forecast_serial', 'forecast_parallel',
+          'forecast_batch']
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+# stages that run on a process pool when more than one worker is used
+POOL_STAGES = {'forecast_parallel'}
+
+
+def make_synthetic(n_series, seed=0):
+    """Population table with `n_series` rows and the columns of the real dataset."""
+    rng = np.random.default_rng(seed)
+    years = np.array([int(year) for year in YEARS])
+    base = rng.lognormal(13, 2, n_series)
+    growth = rng.normal(0.015, 0.01, n_series)
+    noise = rng.normal(1, 0.01, (n_series, len(years)))
+    populations = (base[:, None] * np.exp(growth[:, None] * (years - years[-1])) * noise).astype(np.int64)
+    area = rng.lognormal(10, 2.5, n_series).astype(np.int64) + 1
+    df = pd.DataFrame({
+        'Rank': np.argsort(np.argsort(-populations[:, 0])) + 1,
+        'CCA3': [f'S{i:07d}' for i in range(n_series)],
+        'Country/Territory': [f'Series {i}' for i in range(n_series)],
+        'Capital': [f'Capital {i}' for i in range(n_series)],
+        'Continent': rng.choice(['Africa', 'Asia', 'Europe', 'North America', 'Oceania', 'South America'],
+                                n_series),
+    })
+    for i, column in enumerate(POPULATION_COLUMNS):
+        df[column] = populations[:, i]
+    df['Area (km²)'] = area
+    df['Density (per km²)'] = populations[:, 0] / area
+    df['Growth Rate'] = np.exp(growth)
+    df['World Population Percentage'] = 100 * populations[:, 0] / populations[:, 0].sum()
+    return df
+
+
+def reshape(df):
+    # the transformation used in the notebook
+    time_series_data = df.set_index('CCA3').transpose().drop(NON_POPULATION_COLUMNS)
+    time_series_data.index = time_series_data.index.str.replace(' Population', '')
+    time_series_data.index = pd.to_datetime(time_series_data.index)
+    return time_series_data.astype(int)
+
+
+def _stage_runners(path, df, time_series_data, max_forecast_series, workers, cache_dir):
+    forecast_data = time_series_data.iloc[:, :max_forecast_series]
+
+    def load_cached():
+        clear_memory_cache()
+        return load_population(path, cache_dir)
+
+    return {
+        'load': (lambda: pd.read_csv(path), len(df)),
+        'load_cached': (load_cached, len(df)),
+        'reshape': (lambda: reshape(df), len(df)),
+        'panel': (lambda: PopulationPanel.from_frame(df).to_time_series(), len(df)),
+        'annualize': (lambda: annualize_panel(PopulationPanel.from_frame(df)), len(df)),
+        'corr': (lambda: df.corr(numeric_only=True, method='spearman'), len(df)),
+        'forecast_serial': (lambda: forecast_all(forecast_data, workers=1), forecast_data.shape[1]),
+        'forecast_parallel': (lambda: forecast_all(forecast_data, workers=workers), forecast_data.shape[1]),
+        'forecast_batch': (lambda: batch_forecast(time_series_data), time_series_data.shape[1]),
+    }
+
+
+def measure(func, repeat, pool=False):
+    """Wall times of `repeat` runs and the peak memory of one more run.
+
+    The peak is traced with tracemalloc, or for a `pool` stage taken from
+    the resident memory high-water mark of finished child processes. That
+    mark covers every child this process ever had, so it is only reported
+    (as the largest worker's peak) when this run raised it, else None.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    if pool:
+        before = peak_rss()[1]
+        func()
+        after = peak_rss()[1]
+        return times, after if after is not None and after > before else None
+    # separate traced run, tracemalloc would distort the timings
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def run_benchmarks(datasets, stages=STAGES, repeat=3, max_forecast_series=1000, workers=None):
+    """Benchmark `stages` on every ``(name, path)`` in `datasets` and return the result records."""
+    workers = workers or os.cpu_count() or 1
+    records = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, path in datasets:
+            df = pd.read_csv(path)
+            load_population(path, cache_dir)
+            time_series_data = reshape(df)
+            runners = _stage_runners(path, df, time_series_data, max_forecast_series, workers, cache_dir)
+            for stage in stages:
+                func, n_series = runners[stage]
+                pool = stage in POOL_STAGES and workers > 1
+                times, peak = measure(func, repeat, pool)
+                best = min(times)
+                records.append({
+                    'dataset': name,
+                    'stage': stage,
+                    'series': n_series,
+                    'repeat': repeat,
+                    'best_s': best,
+                    'mean_s': statistics.mean(times),
+                    'series_per_s': n_series / best if best > 0 else float('inf'),
+                    # traced peak of this process, or peak RSS of the largest pool worker
+                    'peak_memory_bytes': peak,
+                    'peak_memory_source': 'worker_rss' if pool else 'tracemalloc',
+                })
+                memory = 'not measured' if peak is None else f"{peak / 2 ** 20:.1f} MiB"
+                print(f"{name:>12} {stage:<18} {best:10.4f}s {records[-1]['series_per_s']:14.1f} series/s "
+                      f"{memory:>14}{' (worker RSS)' if pool else ''}")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='comma separated synthetic dataset sizes, empty for none')
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--max-forecast-series', type=int, default=1000,
+                        help='number of series used by the ARIMA forecast stages')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        datasets = [('world', DATA_PATH)]
+        for size in sizes:
+            path = Path(tmp) / f'synthetic_{size}.csv'
+            make_synthetic(size).to_csv(path, index=False)
+            datasets.append((f'synthetic_{size}', path))
+        records = run_benchmarks(datasets, stages, args.repeat, args.max_forecast_series, args.workers)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'cpu_count': os.cpu_count(),
+                'results': records,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""Command line entry point for the world population analyses.
+
+    python cli.py total --year 2022 --continent Asia
+    python cli.py eda
+    python cli.py forecast --country PHL
+    python cli.py correlate --columns "Area (km²)" "2022 Population"
+    python cli.py correlate --test "Area (km²)" "2022 Population" --by-continent
+    python cli.py query --column "Density (per km²)" --range 100 500 --continent Europe
+    python cli.py export --output world.panel
+    python cli.py forecast --panel-file world.panel --model batch
+    python cli.py report --output report.html
+    python cli.py imports
+
+Only the standard library is imported at startup. pandas, numpy,
+matplotlib and statsmodels are imported inside the subcommands that use
+them, so quick lookups such as `total` start in a fraction of a second.
+"""
+
+import argparse
+import csv
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+DATA_PATH = Path(__file__).with_name('world_population.csv')
+
+HEAVY_MODULES = [
+    'numpy',
+    'pandas',
+    'matplotlib.pyplot',
+    'seaborn',
+    'statsmodels.tsa.arima.model',
+    'statsmodels.tsa.statespace.sarimax',
+]
+
+
+def total(args):
+    # plain csv module, no pandas import for a single sum
+    column = f'{args.year} Population'
+    result = 0
+    with open(args.data, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        if column not in reader.fieldnames:
+            raise SystemExit(f"no column {column!r} in {args.data}")
+        for row in reader:
+            if args.continent and row['Continent'] != args.continent:
+                continue
+            if args.country and row['CCA3'] != args.country.upper():
+                continue
+            result += int(row[column])
+    print(result)
+
+
+def eda(args):
+    import pandas as pd
+    from aggregate_cube import AggregateCube
+    from population_data import load_population
+
+    df = load_population(args.data)
+    print(f"Number of null-values:\n{df.isnull().sum()}\n")
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(df.describe(), end='\n\n')
+        cube = AggregateCube(df)
+        print(cube.frame('Continent'), end='\n\n')
+        print(cube.world_totals())
+
+
+def forecast(args):
+    import numpy as np
+    from forecasting import batch_forecast, forecast_all
+    from population_data import load_time_series
+
+    if args.panel_file:
+        return forecast_panel_file(args)
+    observed = None
+    if args.annual:
+        from annualization import load_annual_time_series
+
+        if args.model == 'ensemble':
+            raise SystemExit('--annual is not supported with --model ensemble')
+        time_series_data, observed = load_annual_time_series(args.data)
+    else:
+        time_series_data = load_time_series(args.data)
+    if args.country:
+        time_series_data = time_series_data[[code.upper() for code in args.country]]
+    if args.model == 'batch':
+        results = batch_forecast(time_series_data, observed=observed)
+    elif args.model == 'ensemble':
+        from models import ensemble_forecast
+        from population_data import load_population
+
+        growth_rate = load_population(args.data).set_index('CCA3')['Growth Rate']
+        results = ensemble_forecast(time_series_data, members=args.members, growth_rate=growth_rate,
+                                    workers=args.workers)
+    else:
+        from forecast_cache import ForecastCache
+        from instrumentation import Instrumentation
+
+        instrumentation = Instrumentation(profile=args.profile, trace_memory=args.trace_memory)
+        with ForecastCache() as cache:
+            results = forecast_all(time_series_data, workers=args.workers, cache=cache,
+                                   instrumentation=instrumentation, observed=observed)
+        if args.metrics:
+            print('Metrics written to', instrumentation.write(args.metrics))
+    for failure in results['failures']:
+        print(f"An exception occurred with the country: {failure.country} ({failure.error})")
+    for country, mae in results['mae_all_countrys'].items():
+        forecast = results['forecast_all_countrys'][country]
+        values = ', '.join(f'{date.year}: {value:,.0f}' for date, value in forecast.items())
+        print(f"Country: {country}, Forecast: {values}, MAE: {mae:.4f}, "
+              f"RMSE: {results['rmse_all_countrys'][country]:.4f}")
+    print("Mean of MAE for all countries:", np.mean(list(results['mae_all_countrys'].values())))
+    print("Mean of RMSE for all countries:", np.mean(list(results['rmse_all_countrys'].values())))
+
+
+def forecast_panel_file(args):
+    import numpy as np
+    from forecasting import batch_forecast_file, forecast_file
+
+    if args.model == 'batch':
+        results = batch_forecast_file(args.panel_file, workers=args.workers)
+        print(f"Series: {len(results['countries'])}")
+        print("Mean of MAE for all series:", np.nanmean(results['mae']))
+        print("Mean of RMSE for all series:", np.nanmean(results['rmse']))
+        return
+    results = forecast_file(args.panel_file, workers=args.workers)
+    print(f"Skipped series: {len(results['failures'])}")
+    print("Mean of MAE for all series:", np.mean(list(results['mae_all_countrys'].values())))
+    print("Mean of RMSE for all series:", np.mean(list(results['rmse_all_countrys'].values())))
+
+
+def reconcile(args):
+    import pandas as pd
+    from population_data import load_population, load_time_series
+    from reconciliation import DEFAULT_METHODS, hierarchical_forecast
+
+    observed = None
+    if args.annual:
+        from annualization import load_annual_time_series
+
+        time_series_data, observed = load_annual_time_series(args.data)
+    else:
+        time_series_data = load_time_series(args.data)
+    results = hierarchical_forecast(time_series_data, load_population(args.data), model=args.model,
+                                    methods=args.methods or DEFAULT_METHODS, observed=observed)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(results['summary'])
+        forecasts = {'base': results['base'], **results['reconciled']}
+        print(pd.DataFrame({method: frame.loc[('World', 'World')] for method, frame in forecasts.items()}).T)
+
+
+def export(args):
+    from population_data import export_panel, load_panel
+
+    print(export_panel(load_panel(args.data), args.output))
+
+
+def correlate(args):
+    import pandas as pd
+    from correlation import pearson_matrix, spearman_matrix
+    from population_data import load_population
+
+    df = load_population(args.data)
+    if args.test:
+        from significance import group_statistics, pair_statistics
+
+        x, y = args.test
+        kwargs = {'n_bootstrap': args.resamples, 'n_permutations': args.resamples}
+        if args.by_continent:
+            table = group_statistics(df, x, y, **kwargs)
+        else:
+            table = pair_statistics(df[x], df[y], **kwargs)
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print(table)
+        return
+    if args.columns:
+        df = df[args.columns]
+    matrix = spearman_matrix(df) if args.method == 'spearman' else pearson_matrix(df)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(matrix)
+
+
+def query(args):
+    import pandas as pd
+    from indexing import PanelIndex
+    from population_data import load_panel
+
+    index = PanelIndex(load_panel(args.data))
+    if args.range:
+        low, high = (None if bound == '-' else float(bound) for bound in args.range)
+        rows = index.range(args.column, low, high, continent=args.continent)
+    else:
+        rows = index.top(args.column, args.top, largest=not args.smallest, continent=args.continent)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(index.frame(rows, [args.column]))
+
+
+def report(args):
+    from report import build_report
+
+    print(build_report(args.output, args.format, args.workers, args.batch))
+
+
+def measure_imports(modules=HEAVY_MODULES):
+    """Cold import time of every module in seconds, each in a fresh interpreter."""
+    timings = {}
+    for module in modules:
+        code = f'import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        timings[module] = float(output.stdout)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, __file__, '--help'], capture_output=True, check=True)
+    timings['cli.py --help (process)'] = time.perf_counter() - start
+    return timings
+
+
+def imports(args):
+    timings = measure_imports()
+    for module, seconds in timings.items():
+        print(f'{module:<40} {seconds * 1000:8.1f} ms')
+    startup = timings['cli.py --help (process)']
+    if args.max_startup_ms is not None and startup * 1000 > args.max_startup_ms:
+        raise SystemExit(f'cli startup took {startup * 1000:.0f} ms, limit is {args.max_startup_ms} ms')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='World population analyses')
+    parser.add_argument('--data', type=Path, default=DATA_PATH, help='population CSV')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sub = subparsers.add_parser('total', help='population total for a year, optionally per continent/country')
+    sub.add_argument('--year', default='2022')
+    sub.add_argument('--continent')
+    sub.add_argument('--country')
+    sub.set_defaults(func=total)
+
+    sub = subparsers.add_parser('eda', help='null check, summary statistics and continent rollups')
+    sub.set_defaults(func=eda)
+
+    sub = subparsers.add_parser('forecast', help='per-country forecasts with MAE/RMSE')
+    sub.add_argument('--country', nargs='+', help='CCA3 codes, default all')
+    sub.add_argument('--model', choices=['arima', 'batch', 'ensemble'], default='arima')
+    sub.add_argument('--members', nargs='+', default=['arima', 'holt', 'loglinear'],
+                     help="models combined by --model ensemble; 'growth_rate' uses the 2022 Growth Rate "
+                          "column, so its scores leak the test years")
+    sub.add_argument('--workers', type=int, default=None)
+    sub.add_argument('--annual', action='store_true', help='fit on the interpolated yearly grid, score census years only')
+    sub.add_argument('--panel-file', help='forecast a panel file from `export` with memory-mapped workers')
+    sub.add_argument('--metrics', help='write ARIMA fit metrics, Prometheus text for *.prom, JSON otherwise')
+    sub.add_argument('--profile', action='store_true', help='run the fit stages under cProfile')
+    sub.add_argument('--trace-memory', action='store_true', help='record tracemalloc peaks per stage')
+    sub.set_defaults(func=forecast)
+
+    sub = subparsers.add_parser('correlate', help='correlation matrix of the numeric columns')
+    sub.add_argument('--method', choices=['spearman', 'pearson'], default='spearman')
+    sub.add_argument('--columns', nargs='+')
+    sub.add_argument('--test', nargs=2, metavar=('X', 'Y'),
+                     help='p-values and confidence intervals for one pair of columns')
+    sub.add_argument('--by-continent', action='store_true')
+    sub.add_argument('--resamples', type=int, default=10_000, help='bootstrap and permutation resamples')
+    sub.set_defaults(func=correlate)
+
+    sub = subparsers.add_parser('query', help='top-k or range query on an indexed column')
+    sub.add_argument('--column', default='2022 Population', help='e.g. "Area (km²)", "Growth Rate"')
+    sub.add_argument('--top', type=int, default=5)
+    sub.add_argument('--smallest', action='store_true')
+    sub.add_argument('--range', nargs=2, metavar=('LOW', 'HIGH'), help="inclusive bounds, '-' for open")
+    sub.add_argument('--continent')
+    sub.set_defaults(func=query)
+
+    sub = subparsers.add_parser('reconcile', help='coherent country, continent and world forecasts')
+    sub.add_argument('--model', choices=['ar', 'drift', 'loglinear'], default='ar')
+    sub.add_argument('--annual', action='store_true', help='use the interpolated yearly grid')
+    sub.add_argument('--methods', nargs='+', help='default all but mint_shrink, which is for small hierarchies only')
+    sub.set_defaults(func=reconcile)
+
+    sub = subparsers.add_parser('export', help='write the population panel to a memory-mappable file')
+    sub.add_argument('--output', default='world.panel')
+    sub.set_defaults(func=export)
+
+    sub = subparsers.add_parser('report', help='headless HTML report')
+    sub.add_argument('--output', default='report.html')
+    sub.add_argument('--format', choices=['png', 'svg'], default='png')
+    sub.add_argument('--workers', type=int, default=None)
+    sub.add_argument('--batch', action='store_true')
+    sub.set_defaults(func=report)
+
+    sub = subparsers.add_parser('imports', help='measure import and startup times')
+    sub.add_argument('--max-startup-ms', type=float, default=None, help='fail if cli startup exceeds this')
+    sub.set_defaults(func=imports)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Spearman and Pearson correlation matrices with cached ranks.
+
+`df.corr(method='spearman')` ranks every column again on each call. The
+`IncrementalCorrelation` engine keeps the average ranks and the sorted values
+of every column, so appending or revising a few rows only shifts existing
+ranks (found with binary searches) instead of sorting everything again.
+`spearman_matrix` is the one-shot path for very large tables.
+
+`check_incremental` replays random appends, updates and removals against
+`DataFrame.corr`; ``python correlation.py`` runs it on the bundled dataset.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+
+def _numeric(data):
+    if isinstance(data, pd.DataFrame):
+        data = data.select_dtypes('number')
+        columns = data.columns
+        values = data.to_numpy(dtype=float)
+    else:
+        values = np.asarray(data, dtype=float)
+        columns = pd.RangeIndex(values.shape[1])
+    if np.isnan(values).any():
+        raise ValueError("correlation input contains missing values")
+    return values, columns
+
+
+def _corr_from_centered(centered, columns, dtype=np.float64):
+    centered = centered.astype(dtype, copy=False)
+    cov = centered.T @ centered
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = cov / np.outer(std, std)
+    np.fill_diagonal(corr, 1.0)
+    return pd.DataFrame(np.clip(corr, -1, 1), index=columns, columns=columns)
+
+
+def rank_columns(values):
+    """Average ranks of every column, as pandas uses for Spearman."""
+    return rankdata(values, method='average', axis=0)
+
+
+def spearman_matrix(data, dtype=np.float64):
+    """Spearman correlation of all numeric columns, matching `df.corr(method='spearman')`.
+
+    Ranks are computed column-wise in one vectorized call and correlated with
+    a single matrix product; pass ``dtype=np.float32`` to halve the memory of
+    the product on very tall tables.
+    """
+    values, columns = _numeric(data)
+    ranks = rank_columns(values)
+    return _corr_from_centered(ranks - (len(ranks) + 1) / 2, columns, dtype)
+
+
+def pearson_matrix(data, dtype=np.float64):
+    values, columns = _numeric(data)
+    return _corr_from_centered(values - values.mean(axis=0), columns, dtype)
+
+
+def _rank_shift(values, changed):
+    # how much the average rank of every entry of `values` moves when
+    # the values `changed` (sorted) are added to or removed from the column
+    less = np.searchsorted(changed, values, side='left')
+    equal = np.searchsorted(changed, values, side='right') - less
+    return less + 0.5 * equal
+
+
+class IncrementalCorrelation:
+    """Spearman/Pearson matrices that follow row appends and updates.
+
+    Per column the engine keeps the current average ranks and a sorted copy
+    of the values. On `append` or `update` every existing rank is shifted by
+    the number of added (removed) values below it, plus one half per tie,
+    which needs binary searches only; the new rows get their rank from the
+    sorted copy. Pearson sums are kept around a fixed shift so updates do not
+    lose precision on population-sized numbers.
+    """
+
+    def __init__(self, data):
+        values, self.columns = _numeric(data)
+        self.values = values
+        self.ranks = rank_columns(values)
+        self._sorted = [np.sort(values[:, j]) for j in range(values.shape[1])]
+        self._shift = values.mean(axis=0) if len(values) else np.zeros(values.shape[1])
+        shifted = values - self._shift
+        self._sum = shifted.sum(axis=0)
+        self._cross = shifted.T @ shifted
+
+    def __len__(self):
+        return len(self.values)
+
+    def _check(self, rows):
+        rows = np.atleast_2d(np.asarray(rows, dtype=float))
+        if rows.shape[1] != len(self.columns):
+            raise ValueError(f"expected {len(self.columns)} columns, got {rows.shape[1]}")
+        if np.isnan(rows).any():
+            raise ValueError("correlation input contains missing values")
+        return rows
+
+    def _insert_ranks(self, rows):
+        new_ranks = np.empty_like(rows)
+        for j in range(rows.shape[1]):
+            old_sorted = self._sorted[j]
+            added = np.sort(rows[:, j])
+            self.ranks[:, j] += _rank_shift(self.values[:, j], added)
+            # rank of each new value among old and new values together
+            new_ranks[:, j] = (_rank_shift(rows[:, j], old_sorted)
+                               + _rank_shift(rows[:, j], added) + 0.5)
+            self._sorted[j] = np.insert(old_sorted, np.searchsorted(old_sorted, added), added)
+        return new_ranks
+
+    def _remove_ranks(self, keep, removed_rows):
+        for j in range(removed_rows.shape[1]):
+            removed = np.sort(removed_rows[:, j])
+            self.ranks[:, j] -= _rank_shift(self.values[:, j], removed)
+            # removed values are part of the rank shift computed above, so
+            # drop them only afterwards
+            positions = np.searchsorted(self._sorted[j], removed)
+            positions += np.arange(len(positions)) - np.searchsorted(removed, removed)
+            self._sorted[j] = np.delete(self._sorted[j], positions)
+        self.ranks = self.ranks[keep]
+        self.values = self.values[keep]
+
+    def _add_moments(self, rows, sign):
+        shifted = rows - self._shift
+        self._sum += sign * shifted.sum(axis=0)
+        self._cross += sign * (shifted.T @ shifted)
+
+    def append(self, rows):
+        """Add rows (one value per column) and update the cached ranks."""
+        rows = self._check(rows)
+        new_ranks = self._insert_ranks(rows)
+        self.values = np.vstack([self.values, rows])
+        self.ranks = np.vstack([self.ranks, new_ranks])
+        self._add_moments(rows, 1)
+
+    def remove(self, positions):
+        """Drop the rows at `positions` (row numbers in insertion order); repeated positions count once."""
+        # unique after normalizing negative positions, otherwise a repeated row
+        # would have its moments and ranks subtracted twice but be dropped once
+        positions = np.unique(np.arange(len(self.values))[np.atleast_1d(positions)])
+        keep = np.ones(len(self.values), dtype=bool)
+        keep[positions] = False
+        removed_rows = self.values[positions]
+        self._add_moments(removed_rows, -1)
+        # the removed rows are shifted together with the rest and dropped
+        # at the end of _remove_ranks
+        self._remove_ranks(keep, removed_rows)
+
+    def update(self, positions, rows):
+        """Replace the rows at `positions` with revised values.
+
+        The revised rows are moved to the end, like a removal followed by an
+        append; the matrices do not depend on row order.
+        """
+        rows = self._check(rows)
+        positions = np.arange(len(self.values))[np.atleast_1d(positions)]
+        if len(np.unique(positions)) != len(positions) or len(positions) != len(rows):
+            raise ValueError("update needs distinct positions and one row per position")
+        self.remove(positions)
+        self.append(rows)
+
+    def spearman(self):
+        return _corr_from_centered(self.ranks - (len(self.ranks) + 1) / 2, self.columns)
+
+    def pearson(self):
+        n = len(self.values)
+        mean = self._sum / n
+        cov = self._cross - n * np.outer(mean, mean)
+        std = np.sqrt(np.diag(cov))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / np.outer(std, std)
+        np.fill_diagonal(corr, 1.0)
+        return pd.DataFrame(np.clip(corr, -1, 1), index=self.columns, columns=self.columns)
+
+
+def check_incremental(data, steps=30, batch=5, seed=0):
+    """Largest deviation of `IncrementalCorrelation` from `DataFrame.corr` over random edits.
+
+    Starts from half of the rows of `data`, then appends, updates and removes
+    (with repeated positions) random rows, compares both matrices with
+    pandas after every step and returns ``{'spearman': ..., 'pearson': ...}``.
+    """
+    values, columns = _numeric(data)
+    rng = np.random.default_rng(seed)
+    current = values[:len(values) // 2]
+    engine = IncrementalCorrelation(pd.DataFrame(current, columns=columns))
+    errors = {'spearman': 0.0, 'pearson': 0.0}
+    for step in range(steps):
+        if step % 3 == 0:
+            # sampled from the existing rows, so the ranks see ties
+            rows = values[rng.integers(len(values), size=batch)]
+            engine.append(rows)
+            current = np.vstack([current, rows])
+        elif step % 3 == 1:
+            positions = rng.choice(len(current), size=batch, replace=False)
+            rows = current[positions] * rng.normal(1, 0.01, (batch, len(columns)))
+            engine.update(positions, rows)
+            current = np.vstack([np.delete(current, positions, axis=0), rows])
+        else:
+            positions = rng.integers(len(current), size=batch)
+            positions[-1] = positions[0]
+            engine.remove(positions)
+            current = np.delete(current, positions, axis=0)
+        expected = pd.DataFrame(current, columns=columns)
+        for method in errors:
+            got = getattr(engine, method)().to_numpy()
+            want = expected.corr(method=method).to_numpy()
+            # NaN on one side only is a mismatch, on both sides (constant column) it is not
+            deviation = np.where(np.isnan(got) & np.isnan(want), 0, np.abs(got - want))
+            errors[method] = max(errors[method], float(np.nan_to_num(deviation, nan=np.inf).max()))
+    return errors
+
+
+if __name__ == '__main__':
+    from population_data import load_population
+
+    errors = check_incremental(load_population())
+    print(errors)
+    if max(errors.values()) > 1e-9:
+        raise SystemExit('IncrementalCorrelation does not match DataFrame.corr')
@@ -0,0 +1,126 @@
+"""Persistent cache of fitted forecast models.
+
+Entries are keyed on the country code, the model order, the train/test split
+and a hash of the series values, so a country is only refitted when its own
+numbers (or the model) change. The store is a single SQLite file with LRU
+eviction by entry count and total size.
+"""
+
+import hashlib
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+CACHE_PATH = Path(__file__).with_name('.cache') / 'forecasts.sqlite'
+
+
+def format_order(order, seasonal_order=None):
+    key = '(' + ','.join(str(x) for x in order) + ')'
+    if seasonal_order is not None:
+        key += 'x(' + ','.join(str(x) for x in seasonal_order) + ')'
+    return key
+
+
+def cache_key(country, values, order, seasonal_order=None, split=None):
+    values = np.ascontiguousarray(values, dtype=float)
+    digest = hashlib.sha256(values.tobytes()).hexdigest()
+    split = split or (len(values) - 2, 3)
+    return f'{country}|{format_order(order, seasonal_order)}|{split[0]}:{split[1]}|{digest}'
+
+
+class ForecastCache:
+    """LRU store of fitted parameters and forecasts.
+
+    `get` and `put` work on plain dicts (e.g. ``{'params': ..., 'forecast':
+    ..., 'mae': ..., 'rmse': ...}``). `hits` and `misses` count lookups since
+    the cache was opened.
+
+    The entry count and total size are kept on the instance (read once when
+    the file is opened), and the limits are enforced in `commit`, once per
+    batch of puts, so filling the cache stays linear.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=100_000, max_bytes=512 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = sqlite3.connect(self.path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS forecasts ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS forecasts_last_used ON forecasts (last_used)')
+        self._db.commit()
+        self._count, self._size = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM forecasts').fetchone()
+
+    def get(self, key):
+        row = self._db.execute('SELECT value FROM forecasts WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute('UPDATE forecasts SET last_used = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        previous = self._db.execute('SELECT size FROM forecasts WHERE key = ?', (key,)).fetchone()
+        self._db.execute('INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?)',
+                         (key, blob, len(blob), time.time()))
+        if previous is None:
+            self._count += 1
+        else:
+            self._size -= previous[0]
+        self._size += len(blob)
+
+    def _over_limit(self):
+        return self._count > self.max_entries or self._size > self.max_bytes
+
+    def _evict(self):
+        if not self._over_limit():
+            return
+        rows = self._db.execute('SELECT key, size FROM forecasts ORDER BY last_used')
+        stale = []
+        for key, entry_size in rows:
+            stale.append((key,))
+            self._count -= 1
+            self._size -= entry_size
+            if not self._over_limit():
+                break
+        rows.close()
+        self._db.executemany('DELETE FROM forecasts WHERE key = ?', stale)
+        self.evictions += len(stale)
+
+    def commit(self):
+        self._evict()
+        self._db.commit()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self),
+        }
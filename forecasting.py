@@ -0,0 +1,505 @@
+"""Forecasting engine for the per-country population models.
+
+The notebook fits one ARIMA model per country. This module runs the same
+fit for every column of `time_series_data` on a process pool and collects
+the results in column order.
+"""
+
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from forecast_cache import cache_key
+from instrumentation import stage
+
+ARIMA_ORDER = (5, 1, 0)
+
+
+@dataclass
+class SeriesResult:
+    country: str
+    forecast: np.ndarray = None
+    mae: float = None
+    rmse: float = None
+    error: str = None
+    params: np.ndarray = None
+    fit_mode: str = None
+    # diagnostics of the fit itself, see `instrumentation.Instrumentation`
+    seconds: float = None
+    iterations: int = None
+    converged: bool = None
+    warnings: tuple = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def split_series(values):
+    # same split as the notebook: fit on all but the last two points and
+    # compare the forecast with the last two observations
+    train = values[:-2]
+    test = values[-3:]
+    return train, test
+
+
+def test_split(n, observed=None):
+    """Length of the training window and the forecast horizons that are scored.
+
+    Without `observed` this is the notebook's split: train on all but the
+    last two points and score the one- and two-step forecasts. With the
+    `observed` flags of an annualized series (ascending), training stops at
+    the third-last census year, because the years interpolated after it
+    already depend on the held-out values, and only the last two census
+    years are scored.
+    """
+    if observed is None:
+        return n - 2, np.array([1, 2])
+    census = np.flatnonzero(np.asarray(observed, dtype=bool))
+    if len(census) < 3:
+        raise ValueError(f"need at least 3 observed years to hold out two, got {len(census)}")
+    return int(census[-3]) + 1, census[-2:] - census[-3]
+
+
+def _check_steps(steps, horizons):
+    if not 1 <= steps <= len(horizons):
+        raise ValueError(f"steps must be between 1 and {len(horizons)}, the number of held-out test points, "
+                         f"got {steps}")
+
+
+def _ascending_flags(observed):
+    # `observed` comes in the order of `time_series_data`, newest year first
+    return None if observed is None else np.asarray(observed, dtype=bool)[::-1]
+
+
+def fit_series(country, values, order=ARIMA_ORDER, seasonal_order=None, observed=None):
+    """Fit ARIMA (or SARIMA) to one ascending series and score the two-step forecast.
+
+    `observed` flags the census years of an annualized series, see `test_split`.
+    """
+    from statsmodels.tsa.arima.model import ARIMA
+
+    start = time.perf_counter()
+    # warnings are recorded instead of printed so they can be reported per country
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        try:
+            train = values[:test_split(len(values), observed)[0]]
+            model = ARIMA(train, order=order, seasonal_order=seasonal_order or (0, 0, 0, 0))
+            arima_model_fit = model.fit()
+            result = _score_fit(country, values, arima_model_fit, "cold", observed)
+        except Exception as e:
+            result = SeriesResult(country, error=f"{type(e).__name__}: {e}")
+    return _with_diagnostics(result, start, caught)
+
+
+def _with_diagnostics(result, start, caught):
+    result.seconds = time.perf_counter() - start
+    result.warnings = tuple(dict.fromkeys(f"{w.category.__name__}: {w.message}" for w in caught))
+    return result
+
+
+def _score_fit(country, values, arima_model_fit, fit_mode, observed=None):
+    end, horizons = test_split(len(values), observed)
+    actual = values[end - 1 + horizons]
+    pop_2022 = values[-1]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        forecast = np.asarray(arima_model_fit.forecast(steps=int(horizons[-1])))[horizons - 1]
+    mae = np.abs(forecast - actual).mean()
+    rmse = ((forecast - actual) ** 2).mean() ** 0.5
+    # optimizer results only exist after `fit`, not after `filter`
+    retvals = getattr(arima_model_fit, "mle_retvals", None) or {}
+    return SeriesResult(country, forecast, mae / pop_2022, rmse / pop_2022,
+                        params=np.asarray(arima_model_fit.params), fit_mode=fit_mode,
+                        iterations=retvals.get("iterations"), converged=retvals.get("converged"))
+
+
+def extend_series(country, values, order=ARIMA_ORDER, params=None, seasonal_order=None, z_threshold=3.0):
+    """Update a fitted model after new observations were appended to `values`.
+
+    The previous `params` are applied to the longer series by running the
+    Kalman filter only, without re-estimating. If the one-step forecast error
+    of the newest training point is larger than `z_threshold` standard
+    errors, the model is re-estimated starting from `params`. Without
+    `params` this is a regular cold fit.
+    """
+    from statsmodels.tsa.arima.model import ARIMA
+
+    if params is None:
+        return fit_series(country, values, order, seasonal_order)
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        try:
+            train, _ = split_series(values)
+            model = ARIMA(train, order=order, seasonal_order=seasonal_order or (0, 0, 0, 0))
+            arima_model_fit = model.filter(params)
+            z = arima_model_fit.standardized_forecasts_error[0, -1]
+            if np.isfinite(z) and abs(z) <= z_threshold:
+                result = _score_fit(country, values, arima_model_fit, "filtered")
+            else:
+                arima_model_fit = model.fit(start_params=params)
+                result = _score_fit(country, values, arima_model_fit, "warm")
+        except Exception as e:
+            result = SeriesResult(country, error=f"{type(e).__name__}: {e}")
+    return _with_diagnostics(result, start, caught)
+
+
+def _fit_chunk(tasks, seasonal_order=None, observed=None):
+    return [fit_series(country, values, order, seasonal_order, observed) for country, values, order in tasks]
+
+
+def _extend_chunk(tasks, seasonal_order=None, z_threshold=3.0):
+    return [extend_series(country, values, order, params, seasonal_order, z_threshold)
+            for country, values, order, params in tasks]
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _run_chunks(chunk_func, tasks, workers, chunksize, *args):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        return chunk_func(tasks, *args)
+    # a few chunks per worker keeps the pool busy without paying the
+    # pickling overhead once per series
+    chunksize = chunksize or max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(chunk_func, chunk, *args) for chunk in _chunks(tasks, chunksize)]
+        return [result for future in futures for result in future.result()]
+
+
+def _cache_entry(result):
+    return {"forecast": result.forecast, "mae": result.mae, "rmse": result.rmse, "params": result.params}
+
+
+def _collect(results, forecast_index):
+    output = {
+        "forecast_all_countrys": {},
+        "mae_all_countrys": {},
+        "rmse_all_countrys": {},
+        "failures": [],
+    }
+    for result in results:
+        if not result.ok:
+            output["failures"].append(result)
+            continue
+        output["forecast_all_countrys"][result.country] = pd.Series(result.forecast, index=forecast_index)
+        output["mae_all_countrys"][result.country] = result.mae
+        output["rmse_all_countrys"][result.country] = result.rmse
+    return output
+
+
+def forecast_all(time_series_data, workers=None, order=ARIMA_ORDER, chunksize=None,
+                 seasonal_order=None, cache=None, orders=None, instrumentation=None, observed=None):
+    """Fit every column of `time_series_data` and collect the results.
+
+    `time_series_data` is the year-indexed frame from the notebook (newest
+    year first, one column per CCA3 code). With `workers=1` the fits run in
+    this process, otherwise on a pool of `workers` processes (default: all
+    cores). Returns a dict with `forecast_all_countrys`, `mae_all_countrys`,
+    `rmse_all_countrys` (keyed in column order) and `failures`, the
+    SeriesResult of every series that could not be fitted.
+
+    With a `forecast_cache.ForecastCache` as `cache`, countries whose series
+    and model are unchanged since an earlier run are served from the cache
+    and only the remaining ones are fitted.
+
+    `orders` overrides `order` per country, either as a ``{country: (p, d,
+    q)}`` dict or as the table returned by `order_selection.select_orders`.
+
+    With an `instrumentation.Instrumentation` the cache lookup, fit and
+    collect stages are timed and every country's fit diagnostics recorded.
+
+    For an annualized frame pass its `observed` flags (same index as
+    `time_series_data`): the forecasts are then scored on the last two
+    census years only, see `test_split`.
+    """
+    index = time_series_data.index[::-1]
+    values = time_series_data.to_numpy(dtype=float)[::-1]
+    observed = _ascending_flags(observed)
+    end, horizons = test_split(len(values), observed)
+    split = None if observed is None else (end, ','.join(str(h) for h in horizons))
+    if isinstance(orders, pd.DataFrame):
+        from order_selection import orders_from_table
+        orders = orders_from_table(orders)
+    orders = orders or {}
+    tasks = [(country, np.ascontiguousarray(values[:, i]), orders.get(country, order))
+             for i, country in enumerate(time_series_data.columns)]
+
+    cached = {}
+    if cache is not None:
+        with stage(instrumentation, "cache_lookup"):
+            keys = {country: cache_key(country, values, country_order, seasonal_order, split)
+                    for country, values, country_order in tasks}
+            for country, values, _ in tasks:
+                entry = cache.get(keys[country])
+                if entry is not None:
+                    cached[country] = SeriesResult(country, fit_mode="cached", **entry)
+            tasks = [task for task in tasks if task[0] not in cached]
+
+    with stage(instrumentation, "fit"):
+        fitted = _run_chunks(_fit_chunk, tasks, workers, chunksize, seasonal_order, observed)
+
+    with stage(instrumentation, "collect"):
+        if cache is not None:
+            for result in fitted:
+                if result.ok:
+                    cache.put(keys[result.country], _cache_entry(result))
+            cache.commit()
+        fitted = {result.country: result for result in fitted}
+        results = [cached[country] if country in cached else fitted[country]
+                   for country in time_series_data.columns]
+        output = _collect(results, index[end - 1 + horizons])
+    _record(instrumentation, results, cached, cache)
+    return output
+
+
+def _record(instrumentation, results, cached, cache):
+    if instrumentation is None:
+        return
+    instrumentation.record_results(results, cached)
+    if cache is not None:
+        instrumentation.record_cache(cache)
+
+
+def refresh_forecasts(time_series_data, cache, workers=None, order=ARIMA_ORDER, seasonal_order=None,
+                      z_threshold=3.0, chunksize=None, instrumentation=None):
+    """Bring cached forecasts up to date after a new census year was added.
+
+    For every country the cache is asked for a fit of the current series
+    first, then for a fit of the series without its newest year (the
+    previous release). Previous parameters are carried over with
+    `extend_series`; countries without any cached fit get a cold fit.
+    Returns the same dict as `forecast_all` plus `fit_modes`, the number of
+    countries per mode ("cached", "filtered", "warm", "cold").
+    `instrumentation` is used as in `forecast_all`.
+    """
+    index = time_series_data.index[::-1]
+    values = time_series_data.to_numpy(dtype=float)[::-1]
+    cached = {}
+    tasks = []
+    keys = {}
+    for i, country in enumerate(time_series_data.columns):
+        series = np.ascontiguousarray(values[:, i])
+        keys[country] = cache_key(country, series, order, seasonal_order)
+        entry = cache.get(keys[country])
+        if entry is not None:
+            cached[country] = SeriesResult(country, fit_mode="cached", **entry)
+            continue
+        previous = cache.get(cache_key(country, series[:-1], order, seasonal_order))
+        tasks.append((country, series, order, previous["params"] if previous else None))
+
+    with stage(instrumentation, "refit"):
+        fitted = _run_chunks(_extend_chunk, tasks, workers, chunksize, seasonal_order, z_threshold)
+    for result in fitted:
+        if result.ok:
+            cache.put(keys[result.country], _cache_entry(result))
+    cache.commit()
+
+    fitted = {result.country: result for result in fitted}
+    results = [cached[country] if country in cached else fitted[country]
+               for country in time_series_data.columns]
+    output = _collect(results, index[-2:])
+    output["fit_modes"] = pd.Series([result.fit_mode for result in results if result.ok]).value_counts().to_dict()
+    _record(instrumentation, results, cached, cache)
+    return output
+
+
+BATCH_MODELS = ("ar", "drift", "loglinear")
+
+
+def _ascending(time_series_data):
+    return time_series_data.index[::-1], time_series_data.to_numpy(dtype=float)[::-1]
+
+
+def _fit_batch_ar(train, p, ridge=1e-8):
+    # differenced AR(p) with intercept, one regression per column solved as a
+    # stack of (p+1)x(p+1) normal equations
+    diffs = np.diff(train, axis=0)
+    rows = diffs.shape[0] - p
+    if rows < p + 1:
+        raise ValueError(f"AR({p}) needs at least {2 * p + 2} training points, got {train.shape[0]}")
+    X = np.ones((diffs.shape[1], rows, p + 1))
+    for lag in range(1, p + 1):
+        X[:, :, lag] = diffs[p - lag:diffs.shape[0] - lag].T
+    y = diffs[p:].T[:, :, None]
+    XtX = X.transpose(0, 2, 1) @ X
+    # scale the ridge term with the data so flat series stay solvable
+    XtX += ridge * np.trace(XtX, axis1=1, axis2=2)[:, None, None] * np.eye(p + 1)
+    coef = np.linalg.solve(XtX, X.transpose(0, 2, 1) @ y)[:, :, 0]
+    return coef, diffs
+
+
+def batch_predict(train, model="ar", p=1, steps=2):
+    """Fit `model` to every column of `train` (years x series, ascending) and forecast `steps` years."""
+    if model not in BATCH_MODELS:
+        raise ValueError(f"Unknown batch model {model!r}, expected one of {BATCH_MODELS}")
+    if model == "ar":
+        coef, diffs = _fit_batch_ar(train, p)
+        history = list(diffs[-p:])
+        level = train[-1]
+        forecast = []
+        for _ in range(steps):
+            step = coef[:, 0] + sum(coef[:, lag] * history[-lag] for lag in range(1, p + 1))
+            level = level + step
+            history.append(step)
+            forecast.append(level)
+        forecast = np.array(forecast)
+    elif model == "drift":
+        drift = (train[-1] - train[0]) / (train.shape[0] - 1)
+        forecast = train[-1] + np.arange(1, steps + 1)[:, None] * drift
+    else:
+        t = np.arange(train.shape[0], dtype=float)
+        X = np.column_stack([np.ones_like(t), t])
+        # the design matrix is shared by all columns, so one lstsq call fits them all
+        coef, *_ = np.linalg.lstsq(X, np.log(np.maximum(train, 1)), rcond=None)
+        future = np.arange(train.shape[0], train.shape[0] + steps, dtype=float)
+        forecast = np.exp(coef[0] + np.outer(future, coef[1]))
+    return forecast
+
+
+def batch_forecast(time_series_data, model="ar", p=1, steps=2, observed=None):
+    """Forecast every column of `time_series_data` at once with NumPy.
+
+    Uses the same train/test split and the same MAE/RMSE normalized by the
+    2022 population as `forecast_all`, including its `observed` flags for
+    annualized frames; `steps` is 1 or 2 as only two test points are held
+    out. `model` is one of:
+
+    - "ar": AR(p) with intercept on the first differences
+    - "drift": last value plus the mean difference (random walk with drift)
+    - "loglinear": least-squares line through the log population
+    """
+    index, values = _ascending(time_series_data)
+    end, horizons = test_split(len(values), _ascending_flags(observed))
+    _check_steps(steps, horizons)
+    horizons = horizons[:steps]
+    pop_2022 = values[-1]
+    forecast = batch_predict(values[:end], model, p, horizons[-1])[horizons - 1]
+
+    errors = forecast - values[end - 1 + horizons]
+    mae = np.abs(errors).mean(axis=0) / pop_2022
+    rmse = np.sqrt((errors ** 2).mean(axis=0)) / pop_2022
+    countries = time_series_data.columns
+    return {
+        "forecast_all_countrys": pd.DataFrame(forecast, index=index[end - 1 + horizons], columns=countries),
+        "mae_all_countrys": dict(zip(countries, mae)),
+        "rmse_all_countrys": dict(zip(countries, rmse)),
+        "failures": [],
+    }
+
+
+def compare_with_arima(batch_results, arima_results):
+    """Per-country accuracy of a batch forecast next to the ARIMA path.
+
+    Both arguments are result dicts from `batch_forecast`/`forecast_all`.
+    Returns a DataFrame with the normalized MAE/RMSE of both paths and the
+    difference between them, restricted to countries ARIMA could fit.
+    """
+    countries = list(arima_results["mae_all_countrys"])
+    comparison = pd.DataFrame({
+        "mae_arima": pd.Series(arima_results["mae_all_countrys"]),
+        "mae_batch": pd.Series(batch_results["mae_all_countrys"]),
+        "rmse_arima": pd.Series(arima_results["rmse_all_countrys"]),
+        "rmse_batch": pd.Series(batch_results["rmse_all_countrys"]),
+    }).loc[countries]
+    comparison["mae_diff"] = comparison["mae_batch"] - comparison["mae_arima"]
+    comparison["rmse_diff"] = comparison["rmse_batch"] - comparison["rmse_arima"]
+    return comparison
+
+
+# Panel files: workers attach a file written by `population_data.export_panel`
+# and read their rows from the shared memory map, so only row ranges are sent
+# to the pool and the data exists once in memory however many workers run.
+
+@lru_cache(maxsize=4)
+def _attached(path):
+    from population_data import attach_values
+
+    return attach_values(path)
+
+
+def _row_ranges(n, workers, block_rows):
+    workers = workers or os.cpu_count() or 1
+    block_rows = block_rows or max(1, -(-n // (workers * 4)))
+    return [(start, min(start + block_rows, n)) for start in range(0, n, block_rows)]
+
+
+def _fit_rows(ranges, path, order, seasonal_order, observed):
+    values, _ = _attached(path)
+    return [fit_series(row, np.asarray(values[row], dtype=float), order, seasonal_order, observed)
+            for start, stop in ranges for row in range(start, stop)]
+
+
+def _file_flags(panel):
+    # an annualized panel is scored on its census years only, see `test_split`
+    return None if panel.observed.all() else panel.observed
+
+
+def forecast_file(path, workers=None, order=ARIMA_ORDER, seasonal_order=None, block_rows=None):
+    """`forecast_all` for a panel file written by `population_data.export_panel`.
+
+    Every worker memory-maps the file and fits its own block of rows.
+    Returns the same dict as `forecast_all`; the `observed` flags stored in
+    the file are used like those passed to `forecast_all`.
+    """
+    from population_data import attach_panel
+
+    panel = attach_panel(path)
+    observed = _file_flags(panel)
+    end, horizons = test_split(len(panel.years), observed)
+    ranges = _row_ranges(len(panel), workers, block_rows)
+    results = _run_chunks(_fit_rows, ranges, workers, 1, str(path), order, seasonal_order, observed)
+    for result in results:
+        result.country = str(panel.codes[result.country])
+    index = pd.to_datetime([str(year) for year in panel.years[end - 1 + horizons]])
+    return _collect(results, index)
+
+
+def _batch_rows(ranges, path, model, p, steps, observed):
+    values, years = _attached(path)
+    end, horizons = test_split(len(years), observed)
+    horizons = horizons[:steps]
+    output = []
+    for start, stop in ranges:
+        # rows are countries with ascending years, the batch models want years x series
+        block = np.asarray(values[start:stop], dtype=float).T
+        forecast = batch_predict(block[:end], model, p, horizons[-1])[horizons - 1]
+        errors = forecast - block[end - 1 + horizons]
+        output.append((forecast.T, np.abs(errors).mean(axis=0) / block[-1],
+                       np.sqrt((errors ** 2).mean(axis=0)) / block[-1]))
+    return output
+
+
+def batch_forecast_file(path, model="ar", p=1, steps=2, workers=None, block_rows=None):
+    """`batch_forecast` for a panel file, split into row blocks over a process pool.
+
+    Meant for panels with millions of series, so the result holds arrays
+    instead of per-country dicts: `countries`, `forecast` (series x steps),
+    `mae` and `rmse`.
+    """
+    from population_data import attach_panel
+
+    panel = attach_panel(path)
+    observed = _file_flags(panel)
+    end, horizons = test_split(len(panel.years), observed)
+    _check_steps(steps, horizons)
+    ranges = _row_ranges(len(panel), workers, block_rows)
+    blocks = _run_chunks(_batch_rows, ranges, workers, 1, str(path), model, p, steps, observed)
+    return {
+        "countries": panel.codes,
+        "years": panel.years[end - 1 + horizons[:steps]],
+        "forecast": np.concatenate([block[0] for block in blocks]),
+        "mae": np.concatenate([block[1] for block in blocks]),
+        "rmse": np.concatenate([block[2] for block in blocks]),
+    }
@@ -0,0 +1,177 @@
+"""Indexes over the population panel for range, top-k and key lookups.
+
+`PanelIndex` keeps
+
+- a sorted index (values sorted once, plus the row of every value) on Area,
+  Density, Growth Rate and every population year, built on first use,
+- a hash index from every Continent (or other categorical column that is
+  looked up) to its rows, also built on first use, and the panel's
+  CCA3 -> row mapping,
+
+so a range query is two binary searches and a top-k query is a slice of the
+sorted rows, instead of a scan or a full sort per query. Forecast results
+are joined in by CCA3 and become indexed columns themselves.
+
+    index = PanelIndex(load_panel())
+    index.range('Density (per km²)', 100, 500)
+    index.top('2022 Population', 5, continent='Asia')
+    index.join(results)
+    index.frame(index.top('mae', 5))
+"""
+
+import heapq
+
+import numpy as np
+import pandas as pd
+
+INDEXED_COLUMNS = ('Area (km²)', 'Density (per km²)', 'Growth Rate')
+
+
+def top_k(values, k, largest=True):
+    """The `k` largest (or smallest) items, best first.
+
+    A dict (e.g. `mae_all_countrys`) gives ``(key, value)`` pairs like
+    ``sorted(d.items(), key=..., reverse=True)[:k]`` using a heap. An array
+    gives the positions of the items using a partial sort. NaN never ranks.
+    """
+    if isinstance(values, dict):
+        items = ((key, value) for key, value in values.items() if value == value)
+        select = heapq.nlargest if largest else heapq.nsmallest
+        return select(k, items, key=lambda x: x[1])
+    values = np.asarray(values, dtype=float)
+    rows = np.flatnonzero(~np.isnan(values))
+    keys = -values[rows] if largest else values[rows]
+    if k < len(rows):
+        part = np.argpartition(keys, k)[:k]
+        rows, keys = rows[part], keys[part]
+    return rows[np.argsort(keys, kind='stable')]
+
+
+class SortedIndex:
+    """Values in ascending order with their row numbers; NaN rows are left out."""
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        order = np.argsort(values, kind='stable')
+        n = len(values) - int(np.isnan(values).sum())
+        self.rows = order[:n]
+        self.keys = values[self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def range(self, low=None, high=None, inclusive=True):
+        """Rows with `low` <= value <= `high` (or < with `inclusive=False`), ascending by value."""
+        start = 0 if low is None else np.searchsorted(self.keys, low, side='left' if inclusive else 'right')
+        stop = len(self.keys) if high is None else np.searchsorted(self.keys, high,
+                                                                    side='right' if inclusive else 'left')
+        return self.rows[start:stop]
+
+    def top(self, k, largest=True):
+        return self.rows[::-1][:k] if largest else self.rows[:k]
+
+
+class HashIndex:
+    """Rows per distinct value of a key column."""
+
+    def __init__(self, values):
+        codes, uniques = pd.factorize(np.asarray(values), sort=True)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        self.groups = {key: order[bounds[i]:bounds[i + 1]] for i, key in enumerate(uniques)}
+
+    def get(self, key):
+        return self.groups.get(key, np.empty(0, dtype=np.intp))
+
+    def get_many(self, keys):
+        return np.sort(np.concatenate([self.get(key) for key in keys]))
+
+
+class PanelIndex:
+    """Sorted and hash indexes over a `population_data.PopulationPanel`."""
+
+    def __init__(self, panel):
+        self.panel = panel
+        self.columns = {column: panel.attributes[column] for column in INDEXED_COLUMNS
+                        if column in panel.attributes}
+        for year in panel.years:
+            self.columns[f'{year} Population'] = panel.year(year)
+        self.sorted = {}
+        self.hashed = {}
+
+    def sorted_index(self, column):
+        if column not in self.columns:
+            raise KeyError(f"{column!r} is not indexed, available: {tuple(self.columns)}")
+        if column not in self.sorted:
+            self.sorted[column] = SortedIndex(self.columns[column])
+        return self.sorted[column]
+
+    def hash_index(self, column):
+        # unique-per-row columns such as Capital would cost a dict entry per
+        # row, so only the columns that are actually looked up get one
+        if column not in self.panel.categories:
+            raise KeyError(f"{column!r} is not a categorical column, available: {tuple(self.panel.categories)}")
+        if column not in self.hashed:
+            self.hashed[column] = HashIndex(self.panel.categories[column].codes)
+        return self.hashed[column]
+
+    def rows(self, codes):
+        """Rows of the given CCA3 codes."""
+        return np.array([self.panel.row[code] for code in codes], dtype=np.intp)
+
+    def lookup(self, column, value):
+        """Rows where categorical `column` equals `value`, e.g. ``lookup('Continent', 'Asia')``."""
+        categories = self.panel.categories[column].categories
+        if value not in categories:
+            return np.empty(0, dtype=np.intp)
+        return self.hash_index(column).get(categories.get_loc(value))
+
+    def range(self, column, low=None, high=None, inclusive=True, continent=None):
+        """Rows with `column` between `low` and `high`, ascending by `column`."""
+        rows = self.sorted_index(column).range(low, high, inclusive)
+        if continent is not None:
+            rows = rows[self._member_mask('Continent', continent, rows)]
+        return rows
+
+    def top(self, column, k, largest=True, continent=None):
+        """Rows of the `k` largest (smallest) values of `column`, best first."""
+        index = self.sorted_index(column)
+        if continent is None:
+            return index.top(k, largest)
+        # walk down the sorted rows in growing blocks until k members are found,
+        # usually the first block is enough
+        rows = index.rows[::-1] if largest else index.rows
+        found, count, start, block = [], 0, 0, max(64, 8 * k)
+        while start < len(rows) and count < k:
+            chunk = rows[start:start + block]
+            found.append(chunk[self._member_mask('Continent', continent, chunk)])
+            count += len(found[-1])
+            start += block
+            block *= 2
+        return np.concatenate(found)[:k] if found else np.empty(0, dtype=np.intp)
+
+    def _member_mask(self, column, value, rows):
+        categorical = self.panel.categories[column]
+        if value not in categorical.categories:
+            return np.zeros(len(rows), dtype=bool)
+        return categorical.codes[rows] == categorical.categories.get_loc(value)
+
+    def join(self, results, columns=('mae', 'rmse')):
+        """Add forecast metrics from a `forecast_all`-style result dict as indexed columns.
+
+        Countries without a result get NaN and are left out of the sorted index.
+        """
+        for column in columns:
+            values = np.full(len(self.panel), np.nan)
+            by_code = results[f'{column}_all_countrys']
+            values[self.rows(by_code.keys())] = list(by_code.values())
+            self.columns[column] = values
+            self.sorted.pop(column, None)
+        return self
+
+    def frame(self, rows, columns=None):
+        """DataFrame of the CCA3 codes, categories and indexed columns of `rows`, in that order."""
+        columns = list(self.columns) if columns is None else columns
+        data = {column: self.panel.categories[column][rows] for column in self.panel.categories}
+        data.update({column: self.columns[column][rows] for column in columns})
+        return pd.DataFrame(data, index=pd.Index(self.panel.codes[rows], name='CCA3'))
@@ -0,0 +1,221 @@
+"""Timings, fit diagnostics and memory usage of a forecasting run.
+
+`Instrumentation` collects
+
+- wall and CPU time of named stages, with the resident memory high-water
+  mark of this process and of finished worker processes after each stage,
+- one record per country fit: time, optimizer iterations, convergence and
+  the warnings statsmodels raised (instead of silencing them),
+- forecast cache hit rates,
+- optionally a cProfile summary and the tracemalloc peak of every stage,
+
+and exports them as JSON or in the Prometheus text format.
+
+    instrumentation = Instrumentation(profile=True)
+    with instrumentation.stage('load'):
+        time_series_data = load_time_series()
+    results = forecast_all(time_series_data, instrumentation=instrumentation)
+    instrumentation.write('metrics.prom')
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PREFIX = 'worldpop'
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and of its finished children."""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+
+@dataclass
+class StageRecord:
+    name: str
+    seconds: float
+    cpu_seconds: float
+    peak_rss: int = None
+    peak_rss_children: int = None
+    traced_peak: int = None
+    profile: str = None
+
+
+@dataclass
+class FitRecord:
+    country: str
+    seconds: float = None
+    iterations: int = None
+    converged: bool = None
+    fit_mode: str = None
+    cached: bool = False
+    error: str = None
+    warnings: list = field(default_factory=list)
+
+
+class Instrumentation:
+    """Recorder for stage timings, per-country fit diagnostics and cache statistics.
+
+    With `profile` every stage runs under cProfile and keeps the `profile_top`
+    most expensive functions; with `trace_memory` the tracemalloc peak of every
+    stage is recorded. Both slow the run down and are off by default.
+    """
+
+    def __init__(self, profile=False, trace_memory=False, profile_top=15):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profile_top = profile_top
+        self.stages = []
+        self.fits = {}
+        self.caches = {}
+
+    @contextmanager
+    def stage(self, name):
+        profiler = cProfile.Profile() if self.profile else None
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record = StageRecord(name, time.perf_counter() - start, time.process_time() - cpu_start,
+                                 *peak_rss())
+            if self.trace_memory:
+                record.traced_peak = tracemalloc.get_traced_memory()[1]
+                if tracing:
+                    tracemalloc.stop()
+            if profiler is not None:
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(self.profile_top)
+                record.profile = stream.getvalue()
+            self.stages.append(record)
+
+    def record_results(self, results, cached=()):
+        """Add the `forecasting.SeriesResult` of every fitted or cached country."""
+        for result in results:
+            self.fits[result.country] = FitRecord(
+                result.country, result.seconds, result.iterations, result.converged, result.fit_mode,
+                result.country in cached, result.error, list(result.warnings))
+
+    def record_cache(self, cache, name='forecasts'):
+        self.caches[name] = cache.stats()
+
+    def slowest(self, n=10):
+        """The `n` slowest country fits, slowest first."""
+        timed = [fit for fit in self.fits.values() if fit.seconds is not None]
+        return sorted(timed, key=lambda fit: fit.seconds, reverse=True)[:n]
+
+    def warning_counts(self):
+        """Number of countries per distinct warning message."""
+        counts = {}
+        for fit in self.fits.values():
+            for message in fit.warnings:
+                counts[message] = counts.get(message, 0) + 1
+        return dict(sorted(counts.items(), key=lambda x: x[1], reverse=True))
+
+    def summary(self):
+        fits = [fit for fit in self.fits.values() if not fit.cached]
+        return {
+            'countries': len(self.fits),
+            'fitted': len(fits),
+            'cached': len(self.fits) - len(fits),
+            'failed': sum(fit.error is not None for fit in fits),
+            'not_converged': sum(fit.converged is False for fit in fits),
+            'with_warnings': sum(bool(fit.warnings) for fit in fits),
+            'fit_seconds': sum(fit.seconds or 0 for fit in fits),
+        }
+
+    def to_dict(self):
+        return {
+            'summary': self.summary(),
+            'stages': [asdict(stage) for stage in self.stages],
+            'caches': self.caches,
+            'warnings': self.warning_counts(),
+            'fits': [asdict(fit) for fit in self.fits.values()],
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent, default=str)
+
+    def to_prometheus(self):
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f'{PREFIX}_{name}{{{label_text}}} {float(value):g}' if labels
+                             else f'{PREFIX}_{name} {float(value):g}')
+
+        stages = self.stages
+        metric('stage_seconds', 'gauge', 'Wall time of a stage.',
+               [({'stage': s.name}, s.seconds) for s in stages])
+        metric('stage_cpu_seconds', 'gauge', 'CPU time of a stage in this process.',
+               [({'stage': s.name}, s.cpu_seconds) for s in stages])
+        metric('stage_peak_rss_bytes', 'gauge', 'Resident memory high-water mark after a stage.',
+               [({'stage': s.name, 'process': 'self'}, s.peak_rss) for s in stages]
+               + [({'stage': s.name, 'process': 'children'}, s.peak_rss_children) for s in stages])
+        metric('stage_traced_peak_bytes', 'gauge', 'tracemalloc peak of a stage.',
+               [({'stage': s.name}, s.traced_peak) for s in stages])
+
+        fits = [fit for fit in self.fits.values() if not fit.cached]
+        metric('fit_seconds', 'gauge', 'Wall time of one country fit.',
+               [({'country': f.country}, f.seconds) for f in fits])
+        metric('fit_iterations', 'gauge', 'Optimizer iterations of one country fit.',
+               [({'country': f.country}, f.iterations) for f in fits])
+        metric('fit_converged', 'gauge', '1 if the optimizer converged.',
+               [({'country': f.country}, f.converged) for f in fits])
+        metric('fit_warnings', 'gauge', 'Distinct warnings raised by one country fit.',
+               [({'country': f.country}, len(f.warnings)) for f in fits if f.warnings])
+        summary = self.summary()
+        metric('fits_total', 'gauge', 'Countries by outcome.',
+               [({'outcome': key}, summary[key]) for key in ('fitted', 'cached', 'failed', 'not_converged')])
+
+        caches = self.caches.items()
+        metric('cache_hits_total', 'counter', 'Cache hits.', [({'cache': n}, s['hits']) for n, s in caches])
+        metric('cache_misses_total', 'counter', 'Cache misses.', [({'cache': n}, s['misses']) for n, s in caches])
+        metric('cache_hit_ratio', 'gauge', 'Cache hit rate.', [({'cache': n}, s['hit_rate']) for n, s in caches])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to `path`, Prometheus text for *.prom files and JSON otherwise."""
+        text = self.to_prometheus() if str(path).endswith('.prom') else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+
+def stage(instrumentation, name):
+    """`instrumentation.stage(name)`, or a no-op context without instrumentation."""
+    return nullcontext() if instrumentation is None else instrumentation.stage(name)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
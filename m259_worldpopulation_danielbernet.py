@@ -38,10 +38,10 @@ Let's start by loading the dataset into the notebook. We'll use the `pandas` lib
 """
 
 import pandas as pd
+from population_data import load_population
 
-# Load the dataset
-url = 'https://raw.githubusercontent.com/maknis3/m259_WorldPopulation/master/world_population.csv'
-df = pd.read_csv(url)
+# Load the dataset (parsed once and cached next to the bundled CSV)
+df = load_population()
 
 """## Column Descriptions
 
@@ -87,6 +87,9 @@ We will perform a check for null or missing values in the dataset. Null values c
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from correlation import spearman_matrix
+from aggregate_cube import AggregateCube
+from plotting import plot_population_lines
 
 # Check for null values
 null_values = df.isnull().sum()
@@ -113,10 +116,9 @@ countries = df['Country/Territory']
 years = df.columns[5:13]
 populations = df.iloc[:, 5:13].values
 
-# Plot the data
+# Plot the data, all countries as a single line collection
 plt.figure(figsize=(10, 6))
-for i in range(len(countries)):
-    plt.plot(years, populations[i], label=countries[i])
+plot_population_lines(years, populations, plt.gca())
 
 # Set the labels and title
 plt.xlabel('Year')
@@ -139,6 +141,9 @@ Now let's explore the continental statistics of the world population dataset. We
 continent_df = df.groupby(by='Continent').sum(numeric_only = True)
 continent_df
 
+# Precomputed continent/year rollups, used by the following charts
+cube = AggregateCube(df, dimensions=('Continent',))
+
 """Based on the analysis of continental statistics, we observed the following findings:
 
 - **Asia** has the highest population, with over 4.7 billion people in 2022, accounting for approximately 59.19% of the world's population. It also has the highest growth rate among the continents.
@@ -151,7 +156,7 @@ continent_df
 """
 
 # Data
-sizes = continent_df['2022 Population']
+sizes = cube.frame('Continent')['2022 Population']
 
 # Plot
 plt.figure(figsize=(8, 8))
@@ -170,7 +175,7 @@ years = ['1970', '1980', '1990', '2000', '2010', '2015', '2020', '2022']
 population_years = []
 for year in years:
   population_years.append(year + " Population")
-total_population = df[population_years].sum(numeric_only = True)
+total_population = cube.world_totals(years)
 
 # Plot
 plt.figure(figsize=(10, 6))
@@ -229,7 +234,7 @@ In summary, the Spearman rank correlation method is the preferred choice for our
 """
 
 # Correlation matrix
-correlation_matrix = df.corr(numeric_only=True, method='spearman')
+correlation_matrix = spearman_matrix(df)  # same result as df.corr(numeric_only=True, method='spearman')
 plt.figure(figsize=(10, 8))
 sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', linewidths=0.5)
 plt.title('Correlation Matrix')
@@ -315,16 +320,13 @@ By comparing the performance of ARIMA and SARIMA models on the population data o
 import pandas as pd
 from statsmodels.tsa.arima.model import ARIMA
 from statsmodels.tsa.statespace.sarimax import SARIMAX
+from population_data import load_population, load_time_series
 
 COUNTRY = 'PHL' # select the country
 
 # Load the dataset
-url = 'https://raw.githubusercontent.com/maknis3/m259_WorldPopulation/master/world_population.csv'
-df = pd.read_csv(url).set_index('CCA3')
-time_series_data = df.transpose().drop(['Rank', 'Country/Territory', 'Capital', 'Continent', 'Area (km²)', 'Density (per km²)', 'Growth Rate', 'World Population Percentage'])
-time_series_data.index = time_series_data.index.str.replace(' Population', '')
-time_series_data.index = pd.to_datetime(time_series_data.index)
-time_series_data = time_series_data.astype(int)
+df = load_population().set_index('CCA3')
+time_series_data = load_time_series()
 data = time_series_data[COUNTRY]
 data = data[::-1] # invert data for ascending order
 train = data[:-2]
@@ -399,54 +401,51 @@ By comparing the performance of the ARIMA model across different countries, we a
 
 import pandas as pd
 import numpy as np
-from statsmodels.tsa.arima.model import ARIMA
 import matplotlib.pyplot as plt
 import warnings
+from forecasting import forecast_all, batch_forecast, compare_with_arima
+from population_data import load_population, load_time_series
+from forecast_cache import ForecastCache
+from instrumentation import Instrumentation
+from indexing import top_k
 
 warnings.filterwarnings("ignore")
 
 # Load the dataset
-url = 'https://raw.githubusercontent.com/maknis3/m259_WorldPopulation/master/world_population.csv'
-df = pd.read_csv(url).set_index('CCA3')
-time_series_data = df.transpose().drop(['Rank', 'Country/Territory', 'Capital', 'Continent', 'Area (km²)', 'Density (per km²)', 'Growth Rate', 'World Population Percentage'])
-time_series_data.index = time_series_data.index.str.replace(' Population', '')
-time_series_data.index = pd.to_datetime(time_series_data.index)
-time_series_data = time_series_data.astype(int)
-
-forecast_all_countrys = {}
-mae_all_countrys = {}
-rmse_all_countrys = {}
-
-skipped_countrys = 0
-
-# Loop through each country
-for country in time_series_data.columns:
-    try:
-        data = time_series_data[country][::-1] # invert data for ascending order
-        train = data[:-2]
-        test = data[-3:]
-
-        pop_2022 = data[-1]
-
-        # ARIMA Model
-        arima_model = ARIMA(train, order=(5,1,0))
-        arima_model_fit = arima_model.fit()
-        forecast = arima_model_fit.forecast(steps=len(test)-1)
-        mae = abs(forecast - test[1:].values).mean()
-        rmse = ((forecast - test[1:].values) ** 2).mean() ** 0.5
-
-        mae_all_countrys[country] = mae / pop_2022
-        rmse_all_countrys[country] = rmse / pop_2022
-    except:
-      print(f"An exception occurred with the country: {country}")
-      print(f"Country will be skipped")
-      skipped_countrys += 1
+df = load_population().set_index('CCA3')
+time_series_data = load_time_series()
+
+# Fit every country, failures are collected instead of raised. The script runs
+# the fits in this process: a pool would re-import this module at top level
+# under the spawn start method (Windows, macOS). `python cli.py forecast` runs
+# them on a process pool.
+# Countries whose series did not change since the last run come from the cache.
+# Timings, optimizer iterations and convergence warnings of every fit are
+# recorded by the instrumentation instead of being lost to the warning filter.
+instrumentation = Instrumentation()
+with ForecastCache() as forecast_cache:
+    results = forecast_all(time_series_data, workers=1, cache=forecast_cache,
+                           instrumentation=instrumentation)
+    print("Forecast cache:", forecast_cache.stats())
+print("Fits:", instrumentation.summary())
+for fit in instrumentation.slowest(5):
+    print(f"Slow fit: {fit.country}, {fit.seconds:.3f}s, {fit.iterations} iterations, converged: {fit.converged}")
+for message, count in list(instrumentation.warning_counts().items())[:5]:
+    print(f"{count} countries: {message}")
+forecast_all_countrys = results["forecast_all_countrys"]
+mae_all_countrys = results["mae_all_countrys"]
+rmse_all_countrys = results["rmse_all_countrys"]
+
+for failure in results["failures"]:
+    print(f"An exception occurred with the country: {failure.country} ({failure.error})")
+    print(f"Country will be skipped")
+skipped_countrys = len(results["failures"])
 
 print("Number of skipped countrys because of error:", skipped_countrys)
 print("Mean of MAE for all countries:", np.mean(list(mae_all_countrys.values())))
 print("Mean of RMSE for all countries:", np.mean(list(rmse_all_countrys.values())))
 
-sorted_mae = sorted(mae_all_countrys.items(), key=lambda x: x[1], reverse=True)[:5]
+sorted_mae = top_k(mae_all_countrys, 5)
 print("List of countrys with the five highest MAE:")
 for country, mae in sorted_mae:
     print(f"Country: {country}, MAE: {mae}")
@@ -461,6 +460,27 @@ plt.ylabel('Value')
 plt.xticks([], [])
 plt.show()
 
+# Batched forecast: differenced AR(1) for all countries as one NumPy problem
+batch_results = batch_forecast(time_series_data, model="ar", p=1)
+comparison = compare_with_arima(batch_results, results)
+print("Mean of MAE for all countries (batch AR):", comparison["mae_batch"].mean())
+print("Mean of RMSE for all countries (batch AR):", comparison["rmse_batch"].mean())
+
+# Ensemble of ARIMA, Holt and log-linear growth, weighted per country by each
+# model's error on the last training point. The dataset's Growth Rate is the
+# 2022 rate, i.e. it already knows the test years, so it is left out here.
+from models import ensemble_forecast
+ensemble_results = ensemble_forecast(time_series_data, workers=1)
+for name, member in ensemble_results["members"].items():
+    print(f"Mean of MAE for all countries ({name}):", np.mean(list(member["mae_all_countrys"].values())))
+print("Mean of MAE for all countries (ensemble):", np.mean(list(ensemble_results["mae_all_countrys"].values())))
+print("Mean ensemble weights:", ensemble_results["weights"].mean().round(3).to_dict())
+
+# Country, continent and world forecasts reconciled so that they add up
+from reconciliation import hierarchical_forecast
+hierarchical_results = hierarchical_forecast(time_series_data, df.reset_index())
+print(hierarchical_results["summary"])
+
 """#### Model Performance:
 
 Overall Performance:
@@ -500,9 +520,9 @@ In this chapter, we explore the relationship between a country's area and its po
 
 import pandas as pd
 import matplotlib.pyplot as plt
+from population_data import load_population
 
-url = 'https://raw.githubusercontent.com/maknis3/m259_WorldPopulation/master/world_population.csv'
-df = pd.read_csv(url).set_index('CCA3')
+df = load_population().set_index('CCA3')
 
 area_population_data = df[['Area (km²)', '2022 Population']]
 
@@ -510,6 +530,11 @@ correlation_coefficient = area_population_data.corr().iloc[0, 1]
 
 print(correlation_coefficient)
 
+# p-values, bootstrap confidence intervals and permutation tests, overall and per continent
+from significance import group_statistics
+area_population_statistics = group_statistics(df, 'Area (km²)', '2022 Population')
+print(area_population_statistics)
+
 plt.figure(figsize=(10, 6))
 plt.scatter(area_population_data['Area (km²)'], area_population_data['2022 Population'])
 plt.title('Correlation between Area and Population')
@@ -0,0 +1,304 @@
+"""Registry of per-country population models and a weighted ensemble.
+
+Every model has the same interface: ``fit(series)`` with a `SeriesData`
+(ascending values, their census years and the country's `Growth Rate`) and
+``forecast(years)`` for the requested future years. Models are registered
+by name:
+
+- "arima": ARIMA, (5, 1, 0) like the notebook
+- "sarimax": SARIMAX, (1, 1, 1)x(1, 1, 1, 12) like the Philippines section
+- "holt": exponential smoothing with additive (optionally damped) trend
+- "loglinear": least-squares line through log population over the census years
+- "growth_rate": last value compounded with the dataset's `Growth Rate` column.
+  That column is the 2022 rate, so it carries information from the held-out
+  test years and its scores are not comparable with the other models; it
+  is not part of `DEFAULT_MEMBERS`
+
+`ensemble_forecast` fits the members for all countries on one shared
+process pool and combines them per country with weights from a validation
+split.
+"""
+
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from forecasting import ARIMA_ORDER, SeriesResult, _chunks, split_series
+
+MODELS = {}
+
+
+def register(name):
+    """Class decorator adding a model to `MODELS` under `name`."""
+    def decorator(cls):
+        cls.name = name
+        MODELS[name] = cls
+        return cls
+    return decorator
+
+
+def get_model(name, **params):
+    if name not in MODELS:
+        raise ValueError(f"Unknown model {name!r}, expected one of {tuple(MODELS)}")
+    return MODELS[name](**params)
+
+
+@dataclass
+class SeriesData:
+    country: str
+    values: np.ndarray
+    years: np.ndarray
+    growth_rate: float = None
+
+    def head(self, n):
+        return SeriesData(self.country, self.values[:n], self.years[:n], self.growth_rate)
+
+
+class Model:
+    """Base class; `cheap` models are closed-form and run in the calling process."""
+
+    cheap = False
+
+    def fit(self, series):
+        raise NotImplementedError
+
+    def forecast(self, years):
+        raise NotImplementedError
+
+
+@contextmanager
+def _quiet():
+    # statsmodels adds its own warning filters when it is first imported, so
+    # the import has to happen before this context is entered
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+class _StatsmodelsModel(Model):
+    def fit(self, series):
+        self.result = self._fit(series.values)
+        return self
+
+    def forecast(self, years):
+        with _quiet():
+            return np.asarray(self.result.forecast(len(years)), dtype=float)
+
+
+@register('arima')
+class ARIMAModel(_StatsmodelsModel):
+    def __init__(self, order=ARIMA_ORDER):
+        self.order = order
+
+    def _fit(self, values):
+        from statsmodels.tsa.arima.model import ARIMA
+
+        with _quiet():
+            return ARIMA(values, order=self.order).fit()
+
+
+@register('sarimax')
+class SARIMAXModel(_StatsmodelsModel):
+    def __init__(self, order=(1, 1, 1), seasonal_order=(1, 1, 1, 12)):
+        self.order = order
+        self.seasonal_order = seasonal_order
+
+    def _fit(self, values):
+        from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+        with _quiet():
+            return SARIMAX(values, order=self.order, seasonal_order=self.seasonal_order).fit(disp=False)
+
+
+@register('holt')
+class HoltModel(_StatsmodelsModel):
+    def __init__(self, damped_trend=False):
+        self.damped_trend = damped_trend
+
+    def _fit(self, values):
+        from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+        with _quiet():
+            return ExponentialSmoothing(values, trend='add', damped_trend=self.damped_trend).fit()
+
+
+@register('loglinear')
+class LogLinearModel(Model):
+    cheap = True
+
+    def fit(self, series):
+        # uses the real census years, so the 5 and 10 year gaps are respected
+        self.slope, self.intercept = np.polyfit(series.years, np.log(np.maximum(series.values, 1)), 1)
+        return self
+
+    def forecast(self, years):
+        return np.exp(self.intercept + self.slope * np.asarray(years, dtype=float))
+
+
+@register('growth_rate')
+class GrowthRateModel(Model):
+    cheap = True
+
+    def fit(self, series):
+        if series.growth_rate is None or not np.isfinite(series.growth_rate):
+            raise ValueError(f"no Growth Rate for {series.country}")
+        self.base = series.values[-1]
+        self.base_year = series.years[-1]
+        self.rate = series.growth_rate
+        return self
+
+    def forecast(self, years):
+        return self.base * self.rate ** (np.asarray(years, dtype=float) - self.base_year)
+
+
+# "growth_rate" would leak the test period into a scored ensemble, see above
+DEFAULT_MEMBERS = ('arima', 'holt', 'loglinear')
+
+
+def prepare(time_series_data, growth_rate=None):
+    """Split every column once into the `SeriesData` used by all models.
+
+    Returns the train series (ascending), the test values as a (3, countries)
+    array, the test years and the 2022 population per country.
+    """
+    index = time_series_data.index[::-1]
+    values = time_series_data.to_numpy(dtype=float)[::-1]
+    years = np.asarray(index.year)
+    train, test = split_series(values)
+    train_years, test_years = split_series(years)
+    rates = {} if growth_rate is None else growth_rate.to_dict()
+    series = [SeriesData(country, np.ascontiguousarray(train[:, i]), train_years, rates.get(country))
+              for i, country in enumerate(time_series_data.columns)]
+    return series, test, test_years, values[-1]
+
+
+def _fit_member(name, params, series, future_years, validation):
+    """Validation and final forecast of one model for one country."""
+    start = time.perf_counter()
+    try:
+        if validation:
+            model = get_model(name, **params).fit(series.head(-validation))
+            holdout = model.forecast(series.years[-validation:])
+            validation_error = np.abs(holdout - series.values[-validation:]).mean()
+        else:
+            validation_error = np.nan
+        forecast = get_model(name, **params).fit(series).forecast(future_years)
+        if not np.all(np.isfinite(forecast)):
+            raise ValueError('non-finite forecast')
+        return series.country, forecast, validation_error, None, time.perf_counter() - start
+    except Exception as e:
+        return series.country, None, np.nan, f"{type(e).__name__}: {e}", time.perf_counter() - start
+
+
+def _member_chunk(name, params, series, future_years, validation):
+    return [_fit_member(name, params, s, future_years, validation) for s in series]
+
+
+def ensemble_forecast(time_series_data, members=DEFAULT_MEMBERS, growth_rate=None, params=None,
+                      validation=1, weighting='inverse_mae', workers=None, executor=None):
+    """Fit every model in `members` to every country and combine the forecasts.
+
+    Each member is fitted twice per country: once without the last
+    `validation` training points to score it, once on the full training
+    split for the forecast. With `weighting='inverse_mae'` each country's
+    ensemble weights are proportional to 1 / validation MAE of the members
+    that could be fitted, with 'equal' they are uniform.
+
+    All statsmodels fits of all members are submitted to one pool (`executor`
+    or a new one with `workers` processes) at once, and the closed-form
+    members run in this process meanwhile, so the ensemble takes about as
+    long as its slowest member. `growth_rate` is the `Growth Rate` column
+    indexed by CCA3, needed by "growth_rate" (opt-in, its scores leak the
+    test period). `params` maps member names to
+    constructor arguments.
+
+    Returns the same keys as `forecasting.forecast_all` for the ensemble plus
+    `members` (per model forecast DataFrame and MAE dict), `weights`
+    (countries x members) and `validation_mae`.
+    """
+    for name in members:
+        get_model(name, **(params or {}).get(name, {}))
+    if weighting not in ('inverse_mae', 'equal'):
+        raise ValueError(f"Unknown weighting {weighting!r}")
+    params = params or {}
+    series, test, test_years, pop_2022 = prepare(time_series_data, growth_rate)
+    future_years = test_years[1:]
+    countries = list(time_series_data.columns)
+
+    workers = workers or os.cpu_count() or 1
+    heavy = [name for name in members if not MODELS[name].cheap]
+    fits = {}
+    own_executor = executor is None and workers > 1 and heavy
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {}
+        if executor is not None:
+            chunksize = max(1, len(series) // (workers * 4))
+            for name in heavy:
+                futures[name] = [executor.submit(_member_chunk, name, params.get(name, {}), chunk,
+                                                 future_years, validation)
+                                 for chunk in _chunks(series, chunksize)]
+        for name in members:
+            if name not in futures:
+                fits[name] = _member_chunk(name, params.get(name, {}), series, future_years, validation)
+        for name, member_futures in futures.items():
+            fits[name] = [fit for future in member_futures for fit in future.result()]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    forecasts = np.full((len(members), len(future_years), len(countries)), np.nan)
+    validation_mae = np.full((len(countries), len(members)), np.nan)
+    for m, name in enumerate(members):
+        for i, (_, forecast, validation_error, _, _) in enumerate(fits[name]):
+            if forecast is not None:
+                forecasts[m, :, i] = forecast
+                validation_mae[i, m] = validation_error
+
+    fitted = np.isfinite(forecasts[:, 0, :]).T
+    if weighting == 'equal' or not validation:
+        weights = fitted.astype(float)
+    else:
+        # scale by the series level so the small epsilon means the same everywhere
+        relative = validation_mae / pop_2022[:, None]
+        weights = np.where(fitted & np.isfinite(relative), 1 / (relative + 1e-12), 0.0)
+        # members without a validation score share equally when nothing else could be scored
+        weights = np.where((weights.sum(axis=1, keepdims=True) == 0) & fitted, 1.0, weights)
+    totals = weights.sum(axis=1, keepdims=True)
+    weights = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+    combined = np.einsum('msc,cm->sc', np.nan_to_num(forecasts), weights)
+
+    index = time_series_data.index[::-1][-len(future_years):]
+    output = _scores(combined, test[1:], pop_2022, countries, index, valid=totals[:, 0] > 0)
+    output['failures'] = [SeriesResult(country, error='no ensemble member could be fitted')
+                          for country, total in zip(countries, totals[:, 0]) if total == 0]
+    output['members'] = {}
+    for m, name in enumerate(members):
+        member = _scores(forecasts[m], test[1:], pop_2022, countries, index, valid=fitted[:, m])
+        member['errors'] = {country: error for country, _, _, error, _ in fits[name] if error}
+        member['seconds'] = sum(fit[4] for fit in fits[name])
+        output['members'][name] = member
+    output['weights'] = pd.DataFrame(weights, index=countries, columns=list(members))
+    output['validation_mae'] = pd.DataFrame(validation_mae / pop_2022[:, None], index=countries,
+                                            columns=list(members))
+    return output
+
+
+def _scores(forecast, actual, pop_2022, countries, index, valid):
+    errors = forecast - actual
+    mae = np.abs(errors).mean(axis=0) / pop_2022
+    rmse = np.sqrt((errors ** 2).mean(axis=0)) / pop_2022
+    keep = [i for i in range(len(countries)) if valid[i]]
+    return {
+        'forecast_all_countrys': pd.DataFrame(forecast[:, keep], index=index,
+                                              columns=[countries[i] for i in keep]),
+        'mae_all_countrys': {countries[i]: mae[i] for i in keep},
+        'rmse_all_countrys': {countries[i]: rmse[i] for i in keep},
+    }
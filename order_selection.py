@@ -0,0 +1,132 @@
+"""Per-country ARIMA order selection.
+
+`(5,1,0)` is more than eight yearly points can support, so this module
+searches a (p,d,q) grid for every country on a process pool and keeps the
+best order by AIC, BIC or holdout MAE. The resulting table can be passed to
+`forecasting.forecast_all(..., orders=...)`.
+
+Likelihoods of differently differenced series are computed on different
+samples and cannot be compared, so with AIC or BIC the differencing order
+is fixed first, by the holdout MAE of ARIMA(0, d, 0), and the information
+criterion only ranks p and q within that d.
+"""
+
+import itertools
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from forecasting import _run_chunks, split_series
+
+CRITERIA = ('aic', 'bic', 'mae')
+HOLDOUT = 2
+
+
+def supports_order(n_obs, order):
+    # require more effective observations (after differencing and the AR
+    # lags) than estimated parameters, including the variance
+    p, d, q = order
+    return n_obs - d - p >= p + q + 2
+
+
+def _score(train, order, criterion):
+    from statsmodels.tsa.arima.model import ARIMA
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if criterion == 'mae':
+            fit = ARIMA(train[:-HOLDOUT], order=order).fit()
+            forecast = fit.forecast(steps=HOLDOUT)
+            return np.abs(forecast - train[-HOLDOUT:]).mean() / train[-1]
+        fit = ARIMA(train, order=order).fit()
+        return fit.aic if criterion == 'aic' else fit.bic
+
+
+def select_d(train, d_values):
+    """Differencing order whose ARIMA(0, d, 0) has the smallest holdout MAE."""
+    best_d, best_score = None, np.inf
+    for d in d_values:
+        if not supports_order(len(train) - HOLDOUT, (0, d, 0)):
+            continue
+        try:
+            score = _score(train, (0, d, 0), 'mae')
+        except Exception:
+            continue
+        if np.isfinite(score) and score < best_score:
+            best_d, best_score = d, score
+    return best_d
+
+
+def search_series(country, values, p_values, d_values, q_values, criterion='aic', patience=1):
+    """Best order for one ascending series.
+
+    Orders the training data cannot support are skipped. With AIC or BIC,
+    `d` is chosen first by `select_d`. For every (d, q) the AR order is
+    increased step by step and the chain is abandoned once `patience`
+    consecutive larger p fail to beat the best score of that chain, since
+    adding lags to an already dominated model rarely helps.
+    """
+    train, _ = split_series(values)
+    n_obs = len(train) - (HOLDOUT if criterion == 'mae' else 0)
+    best_order, best_score, evaluated = None, np.inf, 0
+    if criterion != 'mae':
+        d = select_d(train, d_values)
+        d_values = [] if d is None else [d]
+    for d, q in itertools.product(d_values, q_values):
+        chain_best, misses = np.inf, 0
+        for p in sorted(p_values):
+            order = (p, d, q)
+            if not supports_order(n_obs, order):
+                break
+            try:
+                score = _score(train, order, criterion)
+            except Exception:
+                score = np.inf
+            evaluated += 1
+            if not np.isfinite(score):
+                score = np.inf
+            if score < chain_best:
+                chain_best, misses = score, 0
+            else:
+                misses += 1
+                if misses >= patience:
+                    break
+            if score < best_score:
+                best_order, best_score = order, score
+    return country, best_order, best_score, evaluated
+
+
+def _search_chunk(tasks, grid, criterion, patience):
+    return [search_series(country, values, *grid, criterion=criterion, patience=patience)
+            for country, values in tasks]
+
+
+def select_orders(time_series_data, p_values=range(0, 4), d_values=range(0, 3), q_values=range(0, 3),
+                  criterion='aic', workers=None, patience=1, chunksize=None):
+    """Search the (p,d,q) grid for every column of `time_series_data`.
+
+    Returns a DataFrame indexed by CCA3 with the best `p`, `d`, `q`, its
+    `score` and the number of candidates that were actually `evaluated`.
+    Countries where no candidate could be fitted get a missing order.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"Unknown criterion {criterion!r}, expected one of {CRITERIA}")
+    values = time_series_data.to_numpy(dtype=float)[::-1]
+    tasks = [(country, np.ascontiguousarray(values[:, i]))
+             for i, country in enumerate(time_series_data.columns)]
+    grid = (list(p_values), list(d_values), list(q_values))
+
+    results = _run_chunks(_search_chunk, tasks, workers, chunksize, grid, criterion, patience)
+
+    rows = []
+    for country, order, score, evaluated in results:
+        p, d, q = order if order is not None else (pd.NA, pd.NA, pd.NA)
+        rows.append({'CCA3': country, 'p': p, 'd': d, 'q': q, 'score': score, 'evaluated': evaluated})
+    return pd.DataFrame(rows).set_index('CCA3').astype({'p': 'Int64', 'd': 'Int64', 'q': 'Int64'})
+
+
+def orders_from_table(best_orders):
+    """Turn a `select_orders` table into a ``{country: (p, d, q)}`` dict."""
+    best_orders = best_orders.dropna(subset=['p', 'd', 'q'])
+    return {country: (int(row.p), int(row.d), int(row.q)) for country, row in best_orders.iterrows()}
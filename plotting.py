@@ -0,0 +1,80 @@
+"""Fast population charts.
+
+`plot_population_lines` draws all series as one `LineCollection` instead of
+one `plt.plot` call (and one Line2D artist) per country. For very large
+series counts it can draw a random subset or shade the line density.
+`new_figure` and `save_figure` render without a display, for batch reports.
+"""
+
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+
+LINE_MODES = ('lines', 'density')
+
+
+def new_figure(figsize=(10, 6)):
+    # a bare Figure uses the Agg canvas and never needs a display, whatever
+    # backend pyplot would pick
+    return Figure(figsize=figsize)
+
+
+def save_figure(fig, path, dpi=100):
+    """Write `fig` to `path`; the format (png, svg, pdf, ...) follows the file name."""
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+
+
+def _line_density(x, populations, ax, bins, cmap, chunk_rows=20_000):
+    # sample every segment at evenly spaced points and histogram the samples,
+    # so the image cost depends on the bins and not on the number of lines.
+    # Rows are processed in chunks to keep the sample arrays small.
+    steps = max(2, bins[0] // max(1, len(x) - 1))
+    t = np.linspace(0, 1, steps, endpoint=False)
+    xs = (x[:-1, None] + np.diff(x)[:, None] * t).ravel()
+    x_edges = np.linspace(x[0], x[-1], bins[0] + 1)
+    y_edges = np.linspace(populations.min(), populations.max(), bins[1] + 1)
+    counts = np.zeros(bins)
+    for start in range(0, len(populations), chunk_rows):
+        block = populations[start:start + chunk_rows]
+        ys = (block[:, :-1, None] + np.diff(block, axis=1)[:, :, None] * t).reshape(len(block), -1)
+        counts += np.histogram2d(np.broadcast_to(xs, ys.shape).ravel(), ys.ravel(),
+                                 bins=(x_edges, y_edges))[0]
+    counts[counts == 0] = np.nan
+    return ax.pcolormesh(x_edges, y_edges, counts.T, cmap=cmap, norm=LogNorm(), shading='flat')
+
+
+def plot_population_lines(years, populations, ax, mode='lines', max_series=None, seed=0,
+                          colors=None, alpha=None, linewidth=1.0, bins=(200, 200), cmap='viridis'):
+    """Draw one line per row of `populations` (countries x years) on `ax`.
+
+    `years` are the x labels. With ``mode='lines'`` all rows become a single
+    LineCollection, colored with the axes color cycle like repeated
+    `plt.plot` calls unless `colors` is given; `max_series` draws a random
+    subset of that many rows instead. ``mode='density'`` shades how many
+    lines pass through each cell of a `bins` grid, for tens of thousands of
+    series and more. Returns the added artist.
+    """
+    if mode not in LINE_MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {LINE_MODES}")
+    populations = np.asarray(populations, dtype=float)
+    x = np.arange(len(years), dtype=float)
+    if max_series is not None and len(populations) > max_series:
+        rows = np.random.default_rng(seed).choice(len(populations), max_series, replace=False)
+        populations = populations[np.sort(rows)]
+
+    if mode == 'density':
+        artist = _line_density(x, populations, ax, bins, cmap)
+    else:
+        segments = np.empty(populations.shape + (2,))
+        segments[:, :, 0] = x
+        segments[:, :, 1] = populations
+        if colors is None:
+            colors = rcParams['axes.prop_cycle'].by_key()['color']
+        artist = LineCollection(segments, colors=colors, alpha=alpha, linewidths=linewidth)
+        ax.add_collection(artist)
+        ax.autoscale_view()
+    ax.set_xticks(x)
+    ax.set_xticklabels(list(years))
+    return artist
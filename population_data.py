@@ -0,0 +1,295 @@
+"""Data loading for the world population notebook.
+
+Reads the bundled `world_population.csv` once per process and keeps a typed
+columnar copy on disk (one `.npy` file per column, keyed on the CSV hash), so
+later runs memory-map the columns instead of parsing the CSV again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from functools import cached_property, lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DATA_PATH = Path(__file__).with_name('world_population.csv')
+CACHE_DIR = Path(__file__).with_name('.cache')
+# bump when the layout of the column cache changes, so old caches are not read
+CACHE_VERSION = 2
+
+YEARS = ['2022', '2020', '2015', '2010', '2000', '1990', '1980', '1970']
+POPULATION_COLUMNS = [f'{year} Population' for year in YEARS]
+NON_POPULATION_COLUMNS = ['Rank', 'Country/Territory', 'Capital', 'Continent', 'Area (km²)',
+                          'Density (per km²)', 'Growth Rate', 'World Population Percentage']
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_cache(df, target):
+    # write into a temporary directory first so a crashed run never leaves a
+    # half written cache behind
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=target.parent))
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype.kind not in 'biuf':
+            # a fixed-width string array has no missing value, keep a mask
+            # so NaN does not come back as the string 'nan'
+            missing = df[column].isna().to_numpy()
+            np.save(tmp / f'{i}.missing.npy', missing)
+            values = np.where(missing, '', values).astype(str)
+        np.save(tmp / f'{i}.npy', values)
+        columns.append(column)
+    with open(tmp / 'columns.json', 'w', encoding='utf-8') as f:
+        json.dump(columns, f)
+    try:
+        os.replace(tmp, target)
+    except OSError:
+        # another process wrote the same cache in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _read_cache(target):
+    with open(target / 'columns.json', encoding='utf-8') as f:
+        columns = json.load(f)
+    data = {}
+    for i, column in enumerate(columns):
+        values = np.load(target / f'{i}.npy', mmap_mode='r')
+        if values.dtype.kind not in 'biuf':
+            values = values.astype(object)
+            values[np.load(target / f'{i}.missing.npy')] = np.nan
+        data[column] = values
+    # copy=False keeps the numeric columns on the read-only memory maps
+    return pd.DataFrame(data, copy=False)
+
+
+def _normalize(path, cache_dir):
+    # lru_cache keys on the exact arguments, so spell them out the same way
+    # for every caller
+    return Path(path).resolve(), None if cache_dir is None else Path(cache_dir).resolve()
+
+
+def load_population(path=DATA_PATH, cache_dir=CACHE_DIR):
+    """Return the population table as a DataFrame.
+
+    The same DataFrame is returned on every call with the same arguments,
+    so callers should treat it as read-only (`set_index` and friends return
+    new frames and are fine). With the disk cache the numeric columns are
+    read-only memory maps, so in-place assignment raises; use `df.copy()`. Pass `cache_dir=None` to skip the disk cache.
+    """
+    return _load_population(*_normalize(path, cache_dir))
+
+
+@lru_cache(maxsize=None)
+def _load_population(path, cache_dir):
+    if cache_dir is None:
+        return pd.read_csv(path)
+    target = cache_dir / f'{file_hash(path)}-v{CACHE_VERSION}'
+    if (target / 'columns.json').exists():
+        return _read_cache(target)
+    df = pd.read_csv(path)
+    _write_cache(df, target)
+    # return the memory-mapped frame on the first run too, so every run
+    # gives the same read-only frame
+    return _read_cache(target) if (target / 'columns.json').exists() else df
+
+
+def population_columns(df):
+    """The `<year> Population` columns of `df`, newest year first.
+
+    New census years (e.g. a `2025 Population` column) are picked up
+    automatically.
+    """
+    columns = [column for column in df.columns if str(column).endswith(' Population')]
+    return sorted(columns, key=lambda column: int(column.split()[0]), reverse=True)
+
+
+def to_time_series(df):
+    """Year-indexed population frame with one column per CCA3 code (newest year first)."""
+    time_series_data = df.set_index('CCA3')[population_columns(df)].transpose()
+    time_series_data.index = pd.to_datetime(time_series_data.index.str.replace(' Population', ''))
+    return time_series_data.astype(int)
+
+
+class PopulationPanel:
+    """Compact numeric view of the population table.
+
+    - `values`: contiguous (countries x years) array, years ascending
+    - `years`: the matching year numbers
+    - `codes`: CCA3 codes, with `row` mapping a code to its row
+    - `categories`: string columns (Continent, Capital, ...) as `pd.Categorical`
+    - `attributes`: the remaining numeric columns (Area, Density, ...) as arrays
+    - `observed`: per year, False for years interpolated by `annualization`
+
+    `series`, `year` and `to_time_series` return views into `values`, so
+    slicing a country or a year does not copy the data.
+    """
+
+    def __init__(self, values, years, codes, categories=None, attributes=None, observed=None):
+        self.values = np.ascontiguousarray(values)
+        self.years = np.asarray(years)
+        self.codes = np.asarray(codes)
+        self.categories = categories or {}
+        self.attributes = attributes or {}
+        self.observed = np.ones(len(self.years), dtype=bool) if observed is None else np.asarray(observed)
+        if self.values.shape != (len(self.codes), len(self.years)):
+            raise ValueError(f"values have shape {self.values.shape}, "
+                             f"expected ({len(self.codes)}, {len(self.years)})")
+
+    @classmethod
+    def from_frame(cls, df, dtype=np.int64):
+        columns = population_columns(df)[::-1]
+        years = [int(column.split()[0]) for column in columns]
+        values = np.empty((len(df), len(years)), dtype=dtype)
+        for j, column in enumerate(columns):
+            values[:, j] = df[column].to_numpy()
+        categories = {}
+        attributes = {}
+        for column in NON_POPULATION_COLUMNS:
+            if column not in df.columns:
+                continue
+            if df[column].dtype.kind in 'biuf':
+                attributes[column] = df[column].to_numpy()
+            else:
+                categories[column] = pd.Categorical(df[column])
+        return cls(values, years, df['CCA3'].to_numpy(dtype=str), categories, attributes)
+
+    @cached_property
+    def row(self):
+        return {code: i for i, code in enumerate(self.codes)}
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return (self.values.nbytes + sum(values.nbytes for values in self.attributes.values())
+                + sum(values.codes.nbytes for values in self.categories.values()))
+
+    def series(self, code):
+        return self.values[self.row[code]]
+
+    def year(self, year):
+        """Population column of one year; `KeyError` if the panel has no such year."""
+        i = int(np.searchsorted(self.years, int(year)))
+        if i == len(self.years) or self.years[i] != int(year):
+            raise KeyError(f"no year {year} in the panel, available: {', '.join(str(y) for y in self.years)}")
+        return self.values[:, i]
+
+    def mask(self, column, value):
+        """Boolean row mask for a categorical column, e.g. ``mask('Continent', 'Asia')``."""
+        categorical = self.categories[column]
+        return categorical.codes == categorical.categories.get_loc(value)
+
+    def to_time_series(self):
+        """`time_series_data` as in the notebook (newest year first), sharing memory with `values`."""
+        index = pd.to_datetime([str(year) for year in self.years[::-1]])
+        columns = pd.Index(self.codes, name='CCA3')
+        return pd.DataFrame(self.values.T[::-1], index=index, columns=columns, copy=False)
+
+
+PANEL_MAGIC = b'WPOPPANL'
+PANEL_ALIGN = 64
+
+
+def _aligned(offset):
+    return -(-offset // PANEL_ALIGN) * PANEL_ALIGN
+
+
+def export_panel(panel, path, dtype=np.float64):
+    """Write the numeric part of `panel` to one binary file for `attach_panel`.
+
+    Layout: magic, header length, a JSON header (dtype, shape, years, their
+    `observed` flags, code width and block offsets), then the CCA3 codes as fixed-width bytes and
+    the (countries x years) values, each block 64-byte aligned.
+    """
+    path = Path(path)
+    codes = np.asarray(panel.codes).astype(bytes)
+    n, k = panel.values.shape
+    header = {'dtype': np.dtype(dtype).str, 'shape': [n, k], 'years': [int(year) for year in panel.years],
+              'observed': [bool(flag) for flag in panel.observed], 'code_width': codes.dtype.itemsize}
+    # the offsets depend on the header length, which depends on the offsets
+    header.update(codes_offset=0, values_offset=0)
+    for _ in range(2):
+        start = len(PANEL_MAGIC) + 8 + len(json.dumps(header).encode())
+        header['codes_offset'] = _aligned(start)
+        header['values_offset'] = _aligned(header['codes_offset'] + codes.nbytes)
+    encoded = json.dumps(header).encode()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(PANEL_MAGIC + len(encoded).to_bytes(8, 'little') + encoded)
+        f.seek(header['codes_offset'])
+        f.write(codes.tobytes())
+        f.seek(header['values_offset'])
+        # write row blocks so a large panel is never converted in one piece
+        for start in range(0, n, 1 << 16):
+            f.write(np.ascontiguousarray(panel.values[start:start + (1 << 16)], dtype=dtype).tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def read_panel_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(PANEL_MAGIC)) != PANEL_MAGIC:
+            raise ValueError(f"{path} is not a panel file")
+        length = int.from_bytes(f.read(8), 'little')
+        return json.loads(f.read(length))
+
+
+def attach_values(path):
+    """Read-only memory map of the values of a panel file and its years, without the codes."""
+    header = read_panel_header(path)
+    values = np.memmap(path, dtype=header['dtype'], mode='r', offset=header['values_offset'],
+                       shape=tuple(header['shape']))
+    return values, np.array(header['years'])
+
+
+def attach_panel(path):
+    """`PopulationPanel` backed by a file written with `export_panel`.
+
+    The values are memory-mapped read-only, so every process attaching the
+    same file shares one copy of the data through the page cache.
+    """
+    header = read_panel_header(path)
+    values, years = attach_values(path)
+    codes = np.memmap(path, dtype=f"S{header['code_width']}", mode='r', offset=header['codes_offset'],
+                      shape=(header['shape'][0],))
+    # files written before the flags were stored only hold census years
+    return PopulationPanel(values, years, codes.astype(str), observed=header.get('observed'))
+
+
+def load_panel(path=DATA_PATH, cache_dir=CACHE_DIR):
+    return _load_panel(*_normalize(path, cache_dir))
+
+
+@lru_cache(maxsize=None)
+def _load_panel(path, cache_dir):
+    return PopulationPanel.from_frame(_load_population(path, cache_dir))
+
+
+def load_time_series(path=DATA_PATH, cache_dir=CACHE_DIR):
+    return _load_time_series(*_normalize(path, cache_dir))
+
+
+@lru_cache(maxsize=None)
+def _load_time_series(path, cache_dir):
+    return _load_panel(path, cache_dir).to_time_series()
+
+
+def clear_memory_cache():
+    """Forget the in-process copies, the next load reads the disk cache again."""
+    _load_population.cache_clear()
+    _load_panel.cache_clear()
+    _load_time_series.cache_clear()
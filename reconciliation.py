@@ -0,0 +1,224 @@
+"""Hierarchical forecasts that add up: country -> continent -> world.
+
+Forecasting every country, continent and the world separately gives
+continent forecasts that differ from the sum of their countries.
+`Hierarchy` holds the summing matrix S (one row per node, one column per
+country, 1 where the country belongs to the node) as a SciPy sparse matrix,
+and `reconcile` maps base forecasts of all nodes to coherent ones:
+
+- "bottom_up": sum the country forecasts
+- "top_down": split the world forecast by historical average shares
+- "ols", "wls_struct", "mint": the projection
+  y~ = y^ - W C' (C W C')^-1 C y^ with the constraint matrix C = [I, -A]
+  (aggregates minus the sums of their countries) and a diagonal W: identity,
+  number of countries below each node, or the variance of each node's
+  one-step forecast errors (MinT with a diagonal covariance)
+- "mint_shrink": MinT with the shrunk full error covariance. It is dense
+  (nodes x nodes), so it is opt-in and refused above `MAX_DENSE_NODES`
+
+The diagonal methods only factorize the small (aggregates x aggregates)
+matrix C W C', which is sparse for nested levels, so a hierarchy with
+hundreds of thousands of leaves reconciles in about a second.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from forecasting import _ascending, _ascending_flags, _check_steps, batch_predict, test_split
+
+METHODS = ('bottom_up', 'top_down', 'ols', 'wls_struct', 'mint', 'mint_shrink')
+# the methods that scale to large hierarchies, run by default
+DEFAULT_METHODS = ('bottom_up', 'top_down', 'ols', 'wls_struct', 'mint')
+# a dense nodes x nodes covariance of this size takes about 32 MB
+MAX_DENSE_NODES = 2_000
+
+
+class Hierarchy:
+    """Summing matrix of a leaf level and the aggregation levels above it.
+
+    `levels` is a list of ``(name, labels)`` pairs, top level first, where
+    `labels` gives the node of every leaf on that level. `nodes` is a
+    (level, node) MultiIndex in the row order of `S`: aggregates first,
+    then the leaves.
+    """
+
+    def __init__(self, levels, leaves, leaf_level='leaf'):
+        leaves = np.asarray(leaves)
+        n = len(leaves)
+        blocks, labels = [], []
+        for name, values in levels:
+            codes, uniques = pd.factorize(np.asarray(values), sort=True)
+            blocks.append(sparse.csr_matrix((np.ones(n), (codes, np.arange(n))), shape=(len(uniques), n)))
+            labels += [(name, unique) for unique in uniques]
+        self.aggregation = sparse.vstack(blocks, format='csr')
+        self.S = sparse.vstack([self.aggregation, sparse.identity(n, format='csr')], format='csr')
+        self.nodes = pd.MultiIndex.from_tuples(labels + [(leaf_level, leaf) for leaf in leaves],
+                                               names=['level', 'node'])
+        self.n_aggregates = self.aggregation.shape[0]
+
+    @classmethod
+    def from_frame(cls, df, levels=('Continent',), leaf='CCA3', total='World'):
+        """World -> `levels` -> `leaf` hierarchy from the columns of `df`."""
+        return cls([('World', np.full(len(df), total))] + [(level, df[level].to_numpy()) for level in levels],
+                   df[leaf].to_numpy(), leaf)
+
+    def __len__(self):
+        return self.S.shape[0]
+
+    @property
+    def n_leaves(self):
+        return self.S.shape[1]
+
+    def aggregate(self, leaf_values):
+        """Values of every node from (leaves x k) leaf values."""
+        return self.S @ leaf_values
+
+    def constraints(self):
+        """C = [I, -A]; C @ y is zero exactly when y is coherent."""
+        return sparse.hstack([sparse.identity(self.n_aggregates, format='csr'), -self.aggregation],
+                             format='csr')
+
+    def incoherence(self, values):
+        """Largest |aggregate - sum of its leaves| relative to the aggregate, per column."""
+        gap = np.abs(self.constraints() @ values)
+        return (gap / np.maximum(np.abs(values[:self.n_aggregates]), 1)).max(axis=0)
+
+
+def _shrunk_covariance(residuals):
+    # Schafer-Strimmer shrinkage of the correlation towards the diagonal
+    residuals = residuals - residuals.mean(axis=1, keepdims=True)
+    t = residuals.shape[1]
+    covariance = residuals @ residuals.T / (t - 1)
+    std = np.sqrt(np.diag(covariance))
+    std[std == 0] = 1
+    standardized = residuals / std[:, None]
+    correlation = standardized @ standardized.T / (t - 1)
+    # sum over t of (w_ijt - mean_t w_ij)^2 with w_ijt = s_it s_jt, without the (nodes x nodes x t) tensor
+    squared = standardized ** 2
+    variance = t / (t - 1) ** 3 * (squared @ squared.T - (standardized @ standardized.T) ** 2 / t)
+    off = ~np.eye(len(correlation), dtype=bool)
+    denominator = (correlation[off] ** 2).sum()
+    shrinkage = 1.0 if denominator == 0 else min(1.0, max(0.0, variance[off].sum() / denominator))
+    correlation[off] *= 1 - shrinkage
+    return correlation * std[:, None] * std[None, :]
+
+
+def reconcile(base, hierarchy, method='mint', residuals=None, leaf_history=None):
+    """Coherent forecasts for all nodes from `base` (nodes x horizon, rows as in `hierarchy.nodes`).
+
+    "top_down" needs `leaf_history` (leaves x years) for the shares, "mint"
+    and "mint_shrink" need `residuals` (nodes x observations) of one-step
+    forecasts.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    base = np.asarray(base, dtype=float)
+    S, k = hierarchy.S, hierarchy.n_aggregates
+    if method == 'bottom_up':
+        return S @ base[k:]
+    if method == 'top_down':
+        if leaf_history is None:
+            raise ValueError("top_down needs leaf_history")
+        shares = (leaf_history / leaf_history.sum(axis=0)).mean(axis=1)
+        return S @ (shares[:, None] * base[0])
+
+    C = hierarchy.constraints()
+    if method == 'mint_shrink':
+        if residuals is None:
+            raise ValueError("mint_shrink needs residuals")
+        if len(hierarchy) > MAX_DENSE_NODES:
+            raise ValueError(f"mint_shrink needs a dense covariance of all {len(hierarchy)} nodes, it is only "
+                             f"supported up to {MAX_DENSE_NODES} nodes; use 'mint' for large hierarchies")
+        W = _shrunk_covariance(np.asarray(residuals, dtype=float))
+        # with few residuals the estimate can be singular, keep it positive definite
+        diagonal = np.diag(W).copy()
+        diagonal[diagonal <= 0] = diagonal[diagonal > 0].min() if (diagonal > 0).any() else 1.0
+        W[np.diag_indices_from(W)] = diagonal * (1 + 1e-6)
+        WC = (C @ W).T
+        return base - WC @ np.linalg.solve(np.asarray(C @ WC), C @ base)
+
+    if method == 'ols':
+        weights = np.ones(len(hierarchy))
+    elif method == 'wls_struct':
+        weights = np.asarray(S.sum(axis=1)).ravel()
+    else:
+        if residuals is None:
+            raise ValueError("mint needs residuals")
+        weights = np.var(residuals, axis=1)
+        # a node without forecast errors would otherwise never be adjusted
+        weights = np.maximum(weights, weights[weights > 0].min() if (weights > 0).any() else 1.0)
+    CW = C.multiply(weights[None, :]).tocsr()
+    lu = splu((CW @ C.T).tocsc())
+    return base - CW.T @ lu.solve(C @ base)
+
+
+def hierarchical_forecast(time_series_data, df, levels=('Continent',), model='ar', p=1, steps=2,
+                          methods=DEFAULT_METHODS, min_train=None, observed=None):
+    """Forecast every node of the hierarchy with a batch model and reconcile.
+
+    `time_series_data` is the notebook's frame (one column per CCA3 code),
+    `df` the population table with the `levels` columns. Uses the same split
+    as `forecasting.batch_forecast`; the one-step errors for MinT come from
+    rolling origins over the training years. Returns a dict with the
+    `hierarchy`, the `base` and `reconciled` forecasts (DataFrames, nodes x
+    years), and `summary`, the mean MAE normalized by the 2022 value per
+    method and level, and the largest relative gap between an aggregate and
+    the sum of its countries (`incoherence`).
+
+    `min_train`, the first rolling origin, defaults to 4, or to the 2p+2
+    points an AR(p) needs if that is more.
+
+    `methods` leaves out "mint_shrink" by default; pass it explicitly for
+    small hierarchies (up to `MAX_DENSE_NODES` nodes).
+
+    Passing the annualized frame from `annualization.annualize` with its
+    `observed` flags gives MinT many more one-step errors than the eight
+    census years do; the forecasts are still scored on census years only.
+    """
+    attributes = df.set_index('CCA3').loc[time_series_data.columns].reset_index()
+    hierarchy = Hierarchy.from_frame(attributes, levels)
+    index, leaf_values = _ascending(time_series_data)
+    # (years x nodes), via the sparse S
+    values = (hierarchy.S @ leaf_values.T).T
+    end, horizons = test_split(len(values), _ascending_flags(observed))
+    _check_steps(steps, horizons)
+    horizons = horizons[:steps]
+    train = values[:end]
+    base = batch_predict(train, model, p, horizons[-1])[horizons - 1].T
+
+    residuals = None
+    if {'mint', 'mint_shrink'} & set(methods):
+        ar_min_train = 2 * p + 2 if model == 'ar' else 0
+        if min_train is None:
+            min_train = max(4, ar_min_train)
+        elif min_train < ar_min_train:
+            raise ValueError(f"AR({p}) needs min_train of at least {ar_min_train}, got {min_train}")
+        if min_train >= train.shape[0]:
+            raise ValueError(f"MinT needs one-step errors, but min_train={min_train} leaves no rolling origin "
+                             f"in {train.shape[0]} training points; lower p or leave out the mint methods")
+        residuals = np.stack([batch_predict(train[:cutoff], model, p, 1)[0] - train[cutoff]
+                              for cutoff in range(min_train, train.shape[0])], axis=1)
+
+    actual = values[end - 1 + horizons].T
+    scale = values[-1][:, None]
+    columns = index[end - 1 + horizons]
+    forecasts = {'base': base}
+    for method in methods:
+        forecasts[method] = reconcile(base, hierarchy, method, residuals, leaf_values[:len(train)].T)
+
+    levels_of_nodes = hierarchy.nodes.get_level_values('level')
+    summary = {}
+    for method, forecast in forecasts.items():
+        mae = pd.Series((np.abs(forecast - actual) / scale).mean(axis=1), index=levels_of_nodes)
+        row = mae.groupby(level=0, sort=False).mean()
+        row['incoherence'] = hierarchy.incoherence(forecast).max()
+        summary[method] = row
+    return {
+        'hierarchy': hierarchy,
+        'base': pd.DataFrame(base, index=hierarchy.nodes, columns=columns),
+        'reconciled': {method: pd.DataFrame(forecasts[method], index=hierarchy.nodes, columns=columns)
+                       for method in methods},
+        'summary': pd.DataFrame(summary).T,
+    }
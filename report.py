@@ -0,0 +1,222 @@
+"""Headless report with the notebook's charts and results.
+
+Runs the EDA charts, the per-country forecast and the area/population
+correlation without a display and writes everything into one self-contained
+HTML file. Each chart is rendered by a worker process from plain data, so
+the figures are drawn in parallel with each other and with the forecast fits.
+
+    python report.py --output report.html
+"""
+
+import argparse
+import base64
+import html
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from plotting import new_figure, plot_population_lines
+
+FORMATS = ('png', 'svg')
+
+
+def population_lines(ax, years, populations):
+    plot_population_lines(years, populations, ax)
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Population')
+    ax.set_title('Population Over the Years')
+    ax.invert_xaxis()
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+def continent_pie(ax, labels, sizes):
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140)
+    ax.set_title('2022 Population by Continent')
+    ax.axis('equal')
+
+
+def world_total(ax, years, totals):
+    ax.plot(years, totals, marker='o', linestyle='-', color='b')
+    ax.set_title('Total World Population Over Time')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Population')
+    ax.grid(True)
+
+
+def density_growth(ax, density, growth_rate):
+    ax.scatter(density, growth_rate, alpha=0.5)
+    ax.set_xscale('log')
+    ax.set_xlabel('Population Density (per km²)')
+    ax.set_ylabel('Growth Rate')
+    ax.set_title('Growth Rate vs. Population Density')
+
+
+def correlation_heatmap(ax, correlation_matrix):
+    import seaborn as sns
+
+    sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', linewidths=0.5, ax=ax)
+    ax.set_title('Correlation Matrix')
+
+
+def density_boxplot(ax, density):
+    ax.boxplot(density, vert=False)
+    ax.set_xlabel('Population Density (per km²)')
+    ax.set_title('Distribution of Population Density')
+    ax.set_xscale('log')
+
+
+def forecast_errors(ax, countries, mae, rmse):
+    ax.plot(countries, mae, label='MAE')
+    ax.plot(countries, rmse, label='RMSE')
+    ax.legend()
+    ax.set_title('MAE, and RMSE for all countries')
+    ax.set_xlabel('Country')
+    ax.set_ylabel('Value')
+    ax.set_xticks([], [])
+
+
+def area_population(ax, area, population):
+    ax.scatter(area, population)
+    ax.set_title('Correlation between Area and Population')
+    ax.set_xlabel('Area (km²)')
+    ax.set_ylabel('2022 Population')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+
+
+CHARTS = {
+    'population_lines': (population_lines, (10, 6)),
+    'continent_pie': (continent_pie, (8, 8)),
+    'world_total': (world_total, (10, 6)),
+    'density_growth': (density_growth, (10, 6)),
+    'correlation_heatmap': (correlation_heatmap, (10, 8)),
+    'density_boxplot': (density_boxplot, (10, 6)),
+    'forecast_errors': (forecast_errors, (10, 6)),
+    'area_population': (area_population, (10, 6)),
+}
+
+
+def render_chart(name, kwargs, fmt='png', dpi=100):
+    """Draw one chart from `CHARTS` and return the encoded image bytes."""
+    draw, figsize = CHARTS[name]
+    fig = new_figure(figsize)
+    draw(fig.add_subplot(), **kwargs)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def eda_charts(df, cube, correlation_matrix):
+    years = ['1970', '1980', '1990', '2000', '2010', '2015', '2020', '2022']
+    continents = cube.frame('Continent')
+    return [
+        ('Population Over the Years', 'population_lines',
+         {'years': list(df.columns[5:13]), 'populations': df.iloc[:, 5:13].to_numpy()}),
+        ('2022 Population by Continent', 'continent_pie',
+         {'labels': list(continents.index), 'sizes': continents['2022 Population'].to_numpy()}),
+        ('Total World Population Over Time', 'world_total',
+         {'years': years, 'totals': cube.world_totals(years).to_numpy()}),
+        ('Growth Rate vs. Population Density', 'density_growth',
+         {'density': df['Density (per km²)'].to_numpy(), 'growth_rate': df['Growth Rate'].to_numpy()}),
+        ('Correlation Matrix', 'correlation_heatmap', {'correlation_matrix': correlation_matrix}),
+        ('Distribution of Population Density', 'density_boxplot',
+         {'density': df['Density (per km²)'].to_numpy()}),
+        ('Correlation between Area and Population', 'area_population',
+         {'area': df['Area (km²)'].to_numpy(), 'population': df['2022 Population'].to_numpy()}),
+    ]
+
+
+def _html_report(sections, fmt):
+    mime = 'image/png' if fmt == 'png' else 'image/svg+xml'
+    parts = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8">',
+             '<title>World Population Report</title></head><body>',
+             '<h1>World Population Report</h1>']
+    for title, content in sections:
+        parts.append(f'<h2>{html.escape(title)}</h2>')
+        if isinstance(content, bytes):
+            data = base64.b64encode(content).decode('ascii')
+            parts.append(f'<img alt="{html.escape(title)}" src="data:{mime};base64,{data}">')
+        else:
+            parts.append(content)
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def _table(rows):
+    cells = ''.join(f'<tr><th>{html.escape(str(key))}</th><td>{html.escape(str(value))}</td></tr>'
+                    for key, value in rows)
+    return f'<table>{cells}</table>'
+
+
+def build_report(output='report.html', fmt='png', workers=None, batch=False, forecast_workers=None):
+    """Run the notebook's analyses headless and write an HTML report to `output`.
+
+    Charts are rendered on a pool of `workers` processes while the forecast
+    runs. With `batch` the forecast uses the vectorized batch model instead
+    of the per-country ARIMA fits.
+    """
+    from aggregate_cube import AggregateCube
+    from correlation import spearman_matrix
+    from forecast_cache import ForecastCache
+    from forecasting import batch_forecast, forecast_all
+    from indexing import top_k
+    from significance import pair_statistics
+    from population_data import load_population, load_time_series
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    df = load_population()
+    cube = AggregateCube(df)
+    correlation_matrix = spearman_matrix(df)
+    charts = eda_charts(df, cube, correlation_matrix)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [(title, executor.submit(render_chart, name, kwargs, fmt)) for title, name, kwargs in charts]
+
+        if batch:
+            results = batch_forecast(load_time_series())
+        else:
+            with ForecastCache() as cache:
+                results = forecast_all(load_time_series(), workers=forecast_workers, cache=cache)
+        mae = results['mae_all_countrys']
+        rmse = results['rmse_all_countrys']
+        futures.append(('MAE, and RMSE for all countries', executor.submit(
+            render_chart, 'forecast_errors',
+            {'countries': list(mae), 'mae': list(mae.values()), 'rmse': list(rmse.values())}, fmt)))
+
+        sections = [(title, future.result()) for title, future in futures]
+
+    worst = top_k(mae, 5)
+    area_population_data = df[['Area (km²)', '2022 Population']]
+    sections.append(('Forecast summary', _table(
+        [('Model', 'batch AR(1) on differences' if batch else 'ARIMA(5,1,0)'),
+         ('Skipped countries', len(results['failures'])),
+         ('Mean of MAE for all countries', np.mean(list(mae.values()))),
+         ('Mean of RMSE for all countries', np.mean(list(rmse.values())))]
+        + [(f'MAE {country}', value) for country, value in worst])))
+    statistics = pair_statistics(df['Area (km²)'], df['2022 Population'])
+    sections.append(('Correlation Area & Population', _table(
+        [('Pearson coefficient', area_population_data.corr().iloc[0, 1])]
+        + [(f'{method.capitalize()} {column}', value)
+           for method, row in statistics.iterrows() for column, value in row.items() if column != 'n'])))
+
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(_html_report(sections, fmt))
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='report.html')
+    parser.add_argument('--format', choices=FORMATS, default='png', help='image format inside the report')
+    parser.add_argument('--workers', type=int, default=None, help='chart rendering processes')
+    parser.add_argument('--forecast-workers', type=int, default=None, help='ARIMA fitting processes')
+    parser.add_argument('--batch', action='store_true', help='use the vectorized batch forecaster')
+    args = parser.parse_args(argv)
+    print(build_report(args.output, args.format, args.workers, args.batch, args.forecast_workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""Small asyncio HTTP service around the forecasting code.
+
+The population table is loaded once at startup. Forecasts are served per
+country and per continent:
+
+    GET /forecast/PHL
+    GET /continent/Asia
+    GET /health
+
+Requests that arrive within `batch_window` seconds are coalesced into one
+batch, split over a process pool, and every result is kept in memory, so
+repeated requests are answered from the cache without touching the pool.
+
+    python service.py --port 8080
+    python service.py --self-test        # start the service and run the test client
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+import numpy as np
+
+from forecasting import ARIMA_ORDER, _chunks, _fit_chunk
+
+REASONS = {200: 'OK', 404: 'Not Found', 405: 'Method Not Allowed', 422: 'Unprocessable Entity',
+           500: 'Internal Server Error'}
+
+
+def _warm_worker(_):
+    import statsmodels.tsa.arima.model  # noqa: F401
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ForecastService:
+    """Per-country and per-continent forecasts with request batching and caching."""
+
+    def __init__(self, time_series_data=None, df=None, workers=None, order=ARIMA_ORDER,
+                 batch_window=0.005, max_batch=256):
+        from population_data import load_population, load_time_series
+
+        self.time_series_data = load_time_series() if time_series_data is None else time_series_data
+        df = load_population() if df is None else df
+        self.continents = df.groupby('Continent')['CCA3'].apply(list).to_dict()
+        self.values = self.time_series_data.to_numpy(dtype=float)[::-1]
+        self.years = [str(year.year) for year in self.time_series_data.index[::-1]]
+        self.column = {country: i for i, country in enumerate(self.time_series_data.columns)}
+        self.workers = workers or os.cpu_count() or 1
+        self.order = order
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.results = {}
+        self.responses = {}
+        self.batches = 0
+        self._pending = {}
+        self._queue = []
+        self._flush_task = None
+        self._executor = None
+        self._connections = set()
+
+    def start(self):
+        # forked workers would inherit the open client sockets and keep them
+        # alive after the service closes them, so start them fresh instead
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context(method))
+        # import statsmodels in every worker before the first request arrives
+        list(self._executor.map(_warm_worker, range(self.workers)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    async def country(self, code):
+        """The fitted SeriesResult for `code`, batched with concurrent requests."""
+        if code in self.results:
+            return self.results[code]
+        if code not in self.column:
+            raise HTTPError(404, f'unknown country {code}')
+        if code not in self._pending:
+            self._pending[code] = asyncio.get_running_loop().create_future()
+            self._queue.append(code)
+            if len(self._queue) >= self.max_batch:
+                self._start_flush(0)
+            elif self._flush_task is None:
+                self._start_flush(self.batch_window)
+        return await asyncio.shield(self._pending[code])
+
+    def _start_flush(self, delay):
+        if self._flush_task is not None and delay > 0:
+            return
+        codes, self._queue = self._queue, []
+        self._flush_task = asyncio.ensure_future(self._flush(codes, delay))
+
+    async def _flush(self, codes, delay):
+        if delay:
+            await asyncio.sleep(delay)
+            # requests that arrived while sleeping join this batch
+            codes, self._queue = codes + self._queue, []
+        if self._flush_task is asyncio.current_task():
+            self._flush_task = None
+        if not codes:
+            return
+        self.batches += 1
+        loop = asyncio.get_running_loop()
+        tasks = [(code, np.ascontiguousarray(self.values[:, self.column[code]]), self.order) for code in codes]
+        chunksize = max(1, math.ceil(len(tasks) / self.workers))
+        try:
+            chunks = await asyncio.gather(*[loop.run_in_executor(self._executor, _fit_chunk, chunk)
+                                            for chunk in _chunks(tasks, chunksize)])
+        except Exception as e:
+            for code in codes:
+                self._pending.pop(code).set_exception(e)
+            return
+        for result in (result for chunk in chunks for result in chunk):
+            self.results[result.country] = result
+            self._pending.pop(result.country).set_result(result)
+
+    def _country_payload(self, result):
+        if not result.ok:
+            raise HTTPError(422, result.error)
+        return {
+            'country': result.country,
+            'forecast': dict(zip(self.years[-2:], result.forecast.tolist())),
+            'mae': result.mae,
+            'rmse': result.rmse,
+        }
+
+    async def continent(self, name):
+        if name not in self.continents:
+            raise HTTPError(404, f'unknown continent {name}')
+        results = await asyncio.gather(*[self.country(code) for code in self.continents[name]])
+        fitted = [result for result in results if result.ok]
+        forecast = np.sum([result.forecast for result in fitted], axis=0)
+        columns = [self.column[result.country] for result in fitted]
+        actual = self.values[-2:, columns].sum(axis=1)
+        total_2022 = self.values[-1, columns].sum()
+        return {
+            'continent': name,
+            'countries': len(fitted),
+            'skipped': [result.country for result in results if not result.ok],
+            'forecast': dict(zip(self.years[-2:], forecast.tolist())),
+            'mae': float(np.abs(forecast - actual).mean() / total_2022),
+            'rmse': float(np.sqrt(((forecast - actual) ** 2).mean()) / total_2022),
+        }
+
+    async def respond(self, path):
+        """Encoded JSON body for `path`; served from memory once computed."""
+        if path in self.responses:
+            return self.responses[path]
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if parts == ['health']:
+            return json.dumps({'status': 'ok', 'cached': len(self.results), 'batches': self.batches}).encode()
+        if len(parts) == 2 and parts[0] == 'forecast':
+            payload = self._country_payload(await self.country(parts[1].upper()))
+        elif len(parts) == 2 and parts[0] == 'continent':
+            payload = await self.continent(parts[1])
+        else:
+            raise HTTPError(404, f'no route for {path}')
+        body = json.dumps(payload).encode()
+        self.responses[path] = body
+        return body
+
+    async def wait_connections(self):
+        """Wait until every open client connection has been closed."""
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                try:
+                    if method != 'GET':
+                        raise HTTPError(405, f'{method} is not supported')
+                    status, body = 200, await self.respond(path)
+                except HTTPError as e:
+                    status, body = e.status, json.dumps({'error': str(e)}).encode()
+                except Exception as e:
+                    status, body = 500, json.dumps({'error': f'{type(e).__name__}: {e}'}).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                             f'Content-Type: application/json\r\n'
+                             f'Content-Length: {len(body)}\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    return server
+
+
+async def _client(host, port, paths, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    for path in paths:
+        start = time.perf_counter()
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+        await writer.drain()
+        await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def load_test(host, port, paths, concurrency=32):
+    """Send `paths` over `concurrency` keep-alive connections and report latency and throughput."""
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, paths[i::concurrency], latencies) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+async def self_test(workers=None, rounds=5, concurrency=32):
+    service = ForecastService(workers=workers)
+    server = await serve(service, port=0)
+    host, port = server.sockets[0].getsockname()[:2]
+    paths = [f'/forecast/{code}' for code in service.column]
+    paths += [f'/continent/{name}' for name in service.continents]
+    try:
+        print('cold:', await load_test(host, port, paths, concurrency), 'batches:', service.batches)
+        print('cached:', await load_test(host, port, paths * rounds, concurrency))
+    finally:
+        await service.wait_connections()
+        server.close()
+        await server.wait_closed()
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--self-test', action='store_true', help='run the test client against a local instance')
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        asyncio.run(self_test(args.workers))
+        return
+
+    async def run():
+        service = ForecastService(workers=args.workers)
+        server = await serve(service, args.host, args.port)
+        print(f'Serving forecasts on http://{args.host}:{args.port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            service.close()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
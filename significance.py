@@ -0,0 +1,200 @@
+"""Significance tests and confidence intervals for column correlations.
+
+The notebook reports the area/population Pearson coefficient without a
+p-value. This module adds, for any pair of columns:
+
+- Pearson, Spearman and Kendall (tau-b) coefficients with their analytic
+  p-values from SciPy,
+- bootstrap percentile confidence intervals,
+- two-sided permutation p-values,
+- the same table per continent.
+
+Resampling is vectorized. A bootstrap replicate is a row of multinomial
+counts (how often each country was drawn), so a batch of replicates is one
+count matrix and every coefficient becomes a few matrix products with it:
+weighted moments for Pearson, rank sums per distinct value for Spearman and
+a quadratic form with the pairwise sign matrix for Kendall. Permutations
+are batched the same way. 100k bootstrap replicates of the 234 countries
+take a few seconds per method.
+
+(Named `significance` rather than `statistics` to not shadow the standard
+library module.)
+"""
+
+import numpy as np
+import pandas as pd
+
+METHODS = ('pearson', 'spearman', 'kendall')
+
+
+def _check_method(method):
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+
+
+def _clean(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    return x[keep], y[keep]
+
+
+def correlation_test(x, y, method='pearson'):
+    """Coefficient and two-sided analytic p-value."""
+    from scipy import stats
+
+    _check_method(method)
+    x, y = _clean(x, y)
+    test = {'pearson': stats.pearsonr, 'spearman': stats.spearmanr, 'kendall': stats.kendalltau}[method]
+    result = test(x, y)
+    return float(result[0]), float(result[1])
+
+
+def _weighted_pearson(x, y, counts):
+    # x and y are (n,) or (replicates, n); counts are (replicates, n)
+    total = counts.sum(axis=1, keepdims=True)
+    mx = (counts * x).sum(axis=1, keepdims=True) / total
+    my = (counts * y).sum(axis=1, keepdims=True) / total
+    dx, dy = x - mx, y - my
+    cov = (counts * dx * dy).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return cov / np.sqrt((counts * dx ** 2).sum(axis=1) * (counts * dy ** 2).sum(axis=1))
+
+
+def _weighted_ranks(values, counts):
+    # average ranks of every element inside each resample, ties included
+    uniques, inverse = np.unique(values, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    starts = np.searchsorted(inverse[order], np.arange(len(uniques)))
+    group_counts = np.add.reduceat(counts[:, order], starts, axis=1)
+    ranks = np.cumsum(group_counts, axis=1) - group_counts + (group_counts + 1) / 2
+    return ranks[:, inverse]
+
+
+def _signs(values):
+    return np.sign(values[:, None] - values[None, :])
+
+
+def _bootstrap_batch(x, y, method, counts):
+    if method == 'pearson':
+        return _weighted_pearson(x, y, counts)
+    if method == 'spearman':
+        return _weighted_pearson(_weighted_ranks(x, counts), _weighted_ranks(y, counts), counts)
+    # tau-b over all pairs of drawn elements: c' (Sx * Sy) c / sqrt(c' |Sx| c * c' |Sy| c)
+    sx, sy = _signs(x), _signs(y)
+    concordance = ((counts @ (sx * sy)) * counts).sum(axis=1)
+    pairs_x = ((counts @ np.abs(sx)) * counts).sum(axis=1)
+    pairs_y = ((counts @ np.abs(sy)) * counts).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return concordance / np.sqrt(pairs_x * pairs_y)
+
+
+def _batch_size(n, method):
+    # keep each count matrix (and Kendall's products with it) around 64 MB
+    return max(1, (8 * 1024 * 1024) // (n * (3 if method == 'kendall' else 6)))
+
+
+def bootstrap(x, y, method='pearson', n_resamples=100_000, seed=0, batch_size=None):
+    """Coefficients of `n_resamples` bootstrap resamples of the (x, y) pairs."""
+    _check_method(method)
+    x, y = _clean(x, y)
+    n = len(x)
+    # centre first so the moments do not lose precision on large populations
+    x, y = x - x.mean(), y - y.mean()
+    rng = np.random.default_rng(seed)
+    batch_size = batch_size or _batch_size(n, method)
+    replicates = np.empty(n_resamples)
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        counts = rng.multinomial(n, np.full(n, 1 / n), size=size).astype(float)
+        replicates[start:start + size] = _bootstrap_batch(x, y, method, counts)
+    return replicates
+
+
+def bootstrap_ci(x, y, method='pearson', n_resamples=100_000, confidence=0.95, seed=0):
+    """Percentile bootstrap confidence interval of the coefficient."""
+    replicates = bootstrap(x, y, method, n_resamples, seed)
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(replicates, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def _permuted_coefficients(x, y, method, permutations):
+    if method == 'pearson':
+        xc = (x - x.mean()) / np.linalg.norm(x - x.mean())
+        yp = y[permutations]
+        yp = yp - yp.mean(axis=1, keepdims=True)
+        return (yp @ xc) / np.linalg.norm(yp, axis=1)
+    if method == 'spearman':
+        from scipy.stats import rankdata
+
+        return _permuted_coefficients(rankdata(x), rankdata(y), 'pearson', permutations)
+    # permuting y keeps the tie structure, so only the numerator of tau-b
+    # changes. With x sorted, the pairs (i, i + shift) are compared for all
+    # resamples at once, one shift at a time
+    from scipy.stats import rankdata
+
+    # dense ranks keep every tie and are exact in float32, which halves the memory traffic
+    order = np.argsort(x, kind='stable')
+    xs = x[order]
+    z = rankdata(y, method='dense').astype(np.float32)[permutations][:, order]
+    numerator = np.zeros(len(permutations))
+    for shift in range(1, len(x)):
+        dx = np.sign(xs[shift:] - xs[:-shift]).astype(np.float32)
+        numerator += np.sign(z[:, shift:] - z[:, :-shift]).astype(np.float32) @ dx
+    return 2 * numerator / np.sqrt(_untied_pairs(x) * _untied_pairs(y))
+
+
+def _untied_pairs(values):
+    _, ties = np.unique(values, return_counts=True)
+    return float(len(values)) ** 2 - (ties.astype(float) ** 2).sum()
+
+
+def permutation_test(x, y, method='pearson', n_resamples=100_000, seed=0, batch_size=None):
+    """Two-sided permutation p-value of the coefficient under independence."""
+    _check_method(method)
+    x, y = _clean(x, y)
+    n = len(x)
+    observed = correlation_test(x, y, method)[0]
+    rng = np.random.default_rng(seed)
+    batch_size = batch_size or _batch_size(n, method)
+    extreme = 0
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        permutations = rng.permuted(np.tile(np.arange(n), (size, 1)), axis=1)
+        coefficients = _permuted_coefficients(x, y, method, permutations)
+        # small tolerance so permutations that reproduce the observed value count
+        extreme += int((np.abs(coefficients) >= abs(observed) - 1e-12).sum())
+    return (extreme + 1) / (n_resamples + 1)
+
+
+def pair_statistics(x, y, methods=METHODS, n_bootstrap=10_000, n_permutations=10_000, confidence=0.95,
+                    seed=0):
+    """One row per method with n, coefficient, p-value, bootstrap CI and permutation p-value.
+
+    Set `n_bootstrap` or `n_permutations` to 0 to skip the resampling.
+    """
+    x, y = _clean(x, y)
+    rows = []
+    for method in methods:
+        coefficient, p_value = correlation_test(x, y, method)
+        row = {'method': method, 'n': len(x), 'coefficient': coefficient, 'p_value': p_value}
+        if n_bootstrap:
+            row['ci_low'], row['ci_high'] = bootstrap_ci(x, y, method, n_bootstrap, confidence, seed)
+        if n_permutations:
+            row['permutation_p'] = permutation_test(x, y, method, n_permutations, seed)
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('method')
+
+
+def group_statistics(df, x, y, by='Continent', min_size=3, **kwargs):
+    """`pair_statistics` of columns `x` and `y` of `df` for all rows and per `by` group.
+
+    Groups with fewer than `min_size` rows are left out. Extra keyword
+    arguments go to `pair_statistics`.
+    """
+    frames = {'All': pair_statistics(df[x], df[y], **kwargs)}
+    for group, rows in df.groupby(by, observed=True):
+        if len(rows) >= min_size:
+            frames[group] = pair_statistics(rows[x], rows[y], **kwargs)
+    return pd.concat(frames, names=[by])
@@ -0,0 +1,84 @@
+"""Chunked processing for population tables larger than memory.
+
+The notebook materializes the whole table and transposes it. The functions
+here read the CSV in chunks of `chunksize` rows and only keep running
+aggregates (or one chunk of forecasts) in memory at a time, so memory use
+depends on the chunk size and not on the number of rows.
+"""
+
+import numpy as np
+import pandas as pd
+
+from forecasting import batch_forecast, forecast_all
+from population_data import DATA_PATH, population_columns, to_time_series
+
+CHUNKSIZE = 100_000
+
+
+def iter_chunks(path=DATA_PATH, chunksize=CHUNKSIZE, usecols=None):
+    return pd.read_csv(path, chunksize=chunksize, usecols=usecols)
+
+
+def stream_aggregates(path=DATA_PATH, chunksize=CHUNKSIZE):
+    """World totals per population column and per-continent sums in one pass.
+
+    Returns ``(total_population, continent_df)``, the same values as
+    ``df[population_years].sum()`` and
+    ``df.groupby(by='Continent').sum(numeric_only=True)`` on the full table.
+    """
+    total_population = None
+    continent_df = None
+    for chunk in iter_chunks(path, chunksize):
+        chunk_totals = chunk[population_columns(chunk)].sum()
+        chunk_continents = chunk.groupby(by='Continent').sum(numeric_only=True)
+        if total_population is None:
+            total_population, continent_df = chunk_totals, chunk_continents
+        else:
+            total_population = total_population.add(chunk_totals, fill_value=0)
+            continent_df = continent_df.add(chunk_continents, fill_value=0)
+    if total_population is None:
+        raise ValueError(f"{path} contains no rows")
+    # add() with fill_value turns integer columns into floats
+    integer_columns = chunk.select_dtypes('integer').columns.intersection(continent_df.columns)
+    continent_df[integer_columns] = continent_df[integer_columns].astype(np.int64)
+    return total_population.astype(np.int64), continent_df.sort_index()
+
+
+def stream_world_totals(path=DATA_PATH, chunksize=CHUNKSIZE):
+    return stream_aggregates(path, chunksize)[0]
+
+
+def stream_continent_totals(path=DATA_PATH, chunksize=CHUNKSIZE):
+    return stream_aggregates(path, chunksize)[1]
+
+
+def stream_forecasts(path=DATA_PATH, chunksize=CHUNKSIZE, engine='batch', **kwargs):
+    """Yield forecast results chunk by chunk.
+
+    `engine` is ``'batch'`` (`forecasting.batch_forecast`) or ``'arima'``
+    (`forecasting.forecast_all`); extra keyword arguments are passed on. Each
+    item is the result dict of one chunk, so callers can write it out and
+    drop it before the next chunk is read.
+    """
+    if engine not in ('batch', 'arima'):
+        raise ValueError(f"Unknown engine {engine!r}, expected 'batch' or 'arima'")
+    forecaster = batch_forecast if engine == 'batch' else forecast_all
+    # the population columns come from the header, so new census years are included
+    usecols = ['CCA3'] + population_columns(pd.read_csv(path, nrows=0))
+    for chunk in iter_chunks(path, chunksize, usecols=usecols):
+        yield forecaster(to_time_series(chunk), **kwargs)
+
+
+def stream_forecast_metrics(path=DATA_PATH, chunksize=CHUNKSIZE, engine='batch', **kwargs):
+    """Per-country MAE/RMSE as a DataFrame, built from `stream_forecasts`.
+
+    Only the two metric columns are kept per series, the forecasts themselves
+    are dropped after each chunk.
+    """
+    frames = []
+    for results in stream_forecasts(path, chunksize, engine, **kwargs):
+        frames.append(pd.DataFrame({
+            'mae': pd.Series(results['mae_all_countrys'], dtype=float),
+            'rmse': pd.Series(results['rmse_all_countrys'], dtype=float),
+        }))
+    return pd.concat(frames)